@@ -1,49 +1,84 @@
-import os
-import requests
+import asyncio
+from typing import Optional
+
 import whisper
-from dotenv import load_dotenv, find_dotenv
+from core.chunked_transcriber import transcribe_chunked
+from core.config import Config
+from core.llm_client import llm_client
+from core.model_registry import model_registry
+from core.summary_cache import summary_cache
+from core.tokens import count_tokens, split_by_tokens
+from core.vad import trim_non_speech
+from utils.logger import get_logger
 
-load_dotenv(find_dotenv())
-HF_TOKEN = os.getenv("HF_TOKEN")
-GROQ_TOKEN = os.getenv("GROQ_TOKEN")
+logger = get_logger(__name__)
 
-def transcribe_audio(audio_path: str) -> str:
-    """"
-        Transcribes EN audio
+def transcription_settings() -> dict:
+    """Model and options that determine the transcription result (used as cache key)"""
+    return {
+        'model': Config.WHISPER_MODEL,
+        'word_timestamps': True,
+        'vad': Config.VAD_ENABLED,
+        **model_registry.transcribe_options(),
+    }
+
+def transcribe_audio_result(audio_path: str) -> dict:
+    """
+        Transcribes EN audio, returns the full Whisper result (text, segments, word timestamps)
     """
-    
     print(f"[DEBUG] transcribe_audio called with audio_path: {audio_path}")
-    
-    model = whisper.load_model('base.en')
 
-    result = model.transcribe(
-        audio_path,
-        word_timestamps=True
-    )
+    options = transcription_settings()
+    options.pop('model')
+    options.pop('vad')
+    # Декодируем аудио один раз (16 kHz mono)
+    audio = whisper.load_audio(audio_path)
+    speech_map = None
+    if Config.VAD_ENABLED:
+        audio, speech_map = trim_non_speech(audio)
+    duration = len(audio) / whisper.audio.SAMPLE_RATE
+
+    if Config.TRANSCRIBE_WORKERS > 1 and duration >= Config.TRANSCRIBE_PARALLEL_MIN_SECONDS:
+        result = transcribe_chunked(audio, options, workers=Config.TRANSCRIBE_WORKERS)
+    else:
+        result = model_registry.transcribe(audio, **options)
+
+    # Таймкоды обратно в исходную шкалу времени
+    if speech_map:
+        speech_map.remap_result(result)
 
     print(f"[DEBUG] Whisper result type: {type(result)}")
     print(f"[DEBUG] Whisper result keys: {result.keys() if isinstance(result, dict) else 'N/A'}")
     print(f"[DEBUG] Whisper result['text'] type: {type(result.get('text')) if isinstance(result, dict) else 'N/A'}")
     print(f"[DEBUG] Whisper result['text'] is None: {result.get('text') is None if isinstance(result, dict) else 'N/A'}")
-    
-    return result['text']
 
-def summarize_huggingface(transcript: str, episode_title: str) -> str:
-    API_URL = "https://router.huggingface.co/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {HF_TOKEN}",
-    }
+    return result
 
-    def query(payload):
-        response = requests.post(API_URL, headers=headers, json=payload)
-        if response.status_code == 200:
-            return response.json()
-        return None
+def transcribe_audio(audio_path: str) -> str:
+    """"
+        Transcribes EN audio
+    """
+    return transcribe_audio_result(audio_path)['text']
 
-    prompt = f"""Ты — редактор подкаст-дайджестов на русском языке.
+# Увеличить при любом изменении промптов — старые саммари в кэше перестанут совпадать
+# (2: раньше в кэш могли попасть дайджесты, собранные не из всех кусков)
+PROMPT_VERSION = 2
+
+def summary_settings(episode_title: str, providers: Optional[list] = None) -> dict:
+    """Everything besides the transcript that determines the summary (used as cache key)"""
+    return {
+        # Заголовок входит в промпт: одно аудио в двух фидах даёт разные саммари
+        'episode_title': episode_title,
+        'prompt_version': PROMPT_VERSION,
+        'chunk_tokens': Config.SUMMARY_CHUNK_TOKENS,
+        'providers': llm_client.settings(providers),
+    }
+
+def build_prompt(transcript: str, episode_title: str, source: str = "Транскрипт") -> str:
+    return f"""Ты — редактор подкаст-дайджестов на русском языке.
             Эпизод: {episode_title}
-            Транскрипт:
-            {transcript[:8000]}
+            {source}:
+            {transcript}
             Задача:
             1. Напиши краткое содержание (3-4 абзаца) на русском языке
             2. Выдели 5-7 ключевых инсайтов (bullet points)
@@ -52,64 +87,83 @@ def summarize_huggingface(transcript: str, episode_title: str) -> str:
             Формат ответа должен быть удобен для публикации в Telegram.
         """
 
-    response = query({
-        "messages": [
-            {"role": "system", "content": "Ты эксперт по созданию дайджестов подкастов."},
-            {"role": "user", "content": prompt}
-        ],
-        "model": "openai/gpt-oss-120b:cheapest",
-        "max_tokens": 1500
-    })
+def build_chunk_prompt(chunk: str, episode_title: str, index: int, total: int) -> str:
+    return f"""Ты готовишь материал для дайджеста подкаста.
+            Эпизод: {episode_title}
+            Фрагмент {index} из {total}:
+            {chunk}
+            Задача: перескажи этот фрагмент на русском языке — основные темы, аргументы,
+            факты и цифры. Дословно сохрани 1-2 самые яркие цитаты (на языке оригинала).
+            Пиши сжато, без вступлений.
+        """
+
+async def _summarize_chunks(chunks: list, episode_title: str, providers: Optional[list]) -> Optional[list]:
+    """Map step: summarize chunks concurrently, None if any chunk failed"""
+    semaphore = asyncio.Semaphore(Config.SUMMARY_MAP_CONCURRENCY)
+
+    async def summarize_chunk(index: int, chunk: str) -> Optional[str]:
+        async with semaphore:
+            return await llm_client.complete_async(build_chunk_prompt(chunk, episode_title, index, len(chunks)), providers)
+
+    notes = await asyncio.gather(*(summarize_chunk(index, chunk) for index, chunk in enumerate(chunks, start=1)))
+    failed = sum(1 for note in notes if not note)
+    if failed:
+        # Дайджест без части эпизода хуже повтора — пусть пайплайн запланирует retry
+        logger.warning(f"✗ {failed} of {len(chunks)} transcript chunks could not be summarized, giving up")
+        return None
+    return notes
 
-    if not response:
+async def _map_reduce(transcript: str, episode_title: str, providers: Optional[list]) -> Optional[str]:
+    chunks = split_by_tokens(transcript, Config.SUMMARY_CHUNK_TOKENS)
+    logger.info(f"Map-reduce summary: {len(chunks)} chunks of up to {Config.SUMMARY_CHUNK_TOKENS} tokens")
+    notes = await _summarize_chunks(chunks, episode_title, providers)
+    if not notes:
         return None
-    return response["choices"][0]["message"]["content"]
+
+    # Заметки не помещаются в один запрос — сворачиваем их ещё раз
+    combined = "\n\n".join(notes)
+    while len(notes) > 1 and count_tokens(combined) > Config.SUMMARY_CHUNK_TOKENS:
+        logger.info(f"Collapsing {len(notes)} chunk notes ({count_tokens(combined)} tokens)")
+        collapsed = await _summarize_chunks(split_by_tokens(combined, Config.SUMMARY_CHUNK_TOKENS), episode_title, providers)
+        if not collapsed:
+            return None
+        if len(collapsed) >= len(notes):
+            break
+        notes = collapsed
+        combined = "\n\n".join(notes)
+
+    return await llm_client.complete_async(
+        build_prompt(combined, episode_title, source="Пересказ эпизода по частям"), providers)
+
+def summarize(transcript: str, episode_title: str, providers: Optional[list] = None) -> str:
+    """
+    Summary of the whole transcript from the fastest healthy provider.
+
+    Transcripts longer than SUMMARY_CHUNK_TOKENS are summarized chunk by
+    chunk in parallel, then the chunk notes are reduced into the digest.
+    Results are cached by transcript, title, prompt version and model settings.
+    """
+    cache_key = summary_cache.key_for(transcript, summary_settings(episode_title, providers))
+    summary = summary_cache.get(cache_key)
+    if summary:
+        return summary
+
+    if count_tokens(transcript) <= Config.SUMMARY_CHUNK_TOKENS:
+        summary = llm_client.complete(build_prompt(transcript, episode_title), providers)
+    else:
+        summary = llm_client.run(_map_reduce(transcript, episode_title, providers))
+    # _map_reduce возвращает None, если хоть один кусок не удался, — в кэш попадает только полный дайджест
+    if summary:
+        summary_cache.put(cache_key, summary)
+    return summary
+
+def summarize_huggingface(transcript: str, episode_title: str) -> str:
+    return summarize(transcript, episode_title, providers=['huggingface'])
 
 def summarize_groq(transcript: str, episode_title: str) -> str:
     print(f"[DEBUG] summarize_groq called with transcript length: {len(transcript) if transcript else 0}")
     print(f"[DEBUG] transcript is None: {transcript is None}")
     print(f"[DEBUG] transcript is empty string: {transcript == ''}")
-    
-    prompt = f"""Ты — редактор подкаст-дайджестов на русском языке.
-            Эпизод: {episode_title}
-            Транскрипт:
-            {transcript[:8000]}
-            Задача:
-            1. Напиши краткое содержание (3-4 абзаца) на русском языке
-            2. Выдели 5-7 ключевых инсайтов (bullet points)
-            3. Добавь 2-3 самые интересные цитаты из эпизода
-            4. Напиши, кому будет полезен этот эпизод (1-2 предложения)
-            Формат ответа должен быть удобен для публикации в Telegram.
-        """
 
     print(f"[DEBUG] Sending request to Groq API...")
-    response = requests.post(
-        "https://api.groq.com/openai/v1/chat/completions",
-        headers={
-            "Authorization": f"Bearer {GROQ_TOKEN}",
-            "Content-Type": "application/json"
-        },
-        json={
-            "model": "openai/gpt-oss-120b", 
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "Ты эксперт по созданию кратких содержаний подкастов на русском языке."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            "temperature": 0.7,
-            "max_tokens": 1000
-        }
-    )
-
-    print(f"[DEBUG] Groq API response status: {response.status_code}")
-    if response.status_code != 200:
-        print(f"[DEBUG] Groq API error response: {response.text}")
-    
-    if response.status_code == 200:
-        return response.json()['choices'][0]['message']['content']
-    return None
\ No newline at end of file
+    return summarize(transcript, episode_title, providers=['groq'])
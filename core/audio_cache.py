@@ -0,0 +1,147 @@
+# audio_cache.py
+"""
+Managed cache for downloaded episode audio.
+
+Files are named by a hash of the audio URL (not by the truncated title,
+which used to collide), tracked in the audio_cache table with their size,
+state and last access time, and evicted least-recently-used first once
+the directory exceeds its byte budget. Files pinned by a running pipeline
+are never evicted. Downloads of the same URL are serialised with a
+per-key lock, since they share one .part file and checkpoint.
+"""
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+from typing import Optional
+from urllib.parse import urlsplit
+
+from core.config import Config
+from data.database import DB
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+STATE_PARTIAL = 'partial'
+STATE_COMPLETE = 'complete'
+
+
+class AudioCache:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._pins = {}
+        self._downloads = {}  # key -> [lock, число ожидающих/качающих]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(audio_url: str) -> str:
+        return hashlib.sha256(audio_url.encode()).hexdigest()
+
+    def path_for(self, audio_url: str) -> str:
+        extension = os.path.splitext(urlsplit(audio_url).path)[1].lower()
+        if not extension or len(extension) > 5:
+            extension = '.mp3'
+        return os.path.join(self.directory, f"{self.key_for(audio_url)[:32]}{extension}")
+
+    def lookup(self, audio_url: str) -> Optional[str]:
+        """Path of a fully downloaded copy of audio_url, if there is one"""
+        key = self.key_for(audio_url)
+        entry = DB.get_audio_cache(key)
+        if not entry or entry['state'] != STATE_COMPLETE:
+            return None
+        if not os.path.exists(entry['path']):
+            DB.delete_audio_cache(key)
+            return None
+        DB.touch_audio_cache(key)
+        return entry['path']
+
+    def start(self, audio_url: str) -> str:
+        """Register a download in progress, returns the target path"""
+        path = self.path_for(audio_url)
+        DB.save_audio_cache(self.key_for(audio_url), audio_url, path, 0, STATE_PARTIAL)
+        return path
+
+    def complete(self, audio_url: str, path: str) -> None:
+        DB.save_audio_cache(self.key_for(audio_url), audio_url, path, os.path.getsize(path), STATE_COMPLETE)
+        self.evict()
+
+    # --- Защита файлов, которые сейчас использует пайплайн ---
+
+    def acquire(self, audio_url: str) -> None:
+        key = self.key_for(audio_url)
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + 1
+
+    def release(self, audio_url: str) -> None:
+        key = self.key_for(audio_url)
+        with self._lock:
+            count = self._pins.get(key, 0) - 1
+            if count > 0:
+                self._pins[key] = count
+            else:
+                self._pins.pop(key, None)
+
+    @contextmanager
+    def pinned(self, audio_url: str):
+        self.acquire(audio_url)
+        try:
+            yield
+        finally:
+            self.release(audio_url)
+
+    @contextmanager
+    def downloading(self, audio_url: str):
+        """Exclusive access to the download of audio_url (its .part file and checkpoint)"""
+        key = self.key_for(audio_url)
+        with self._lock:
+            entry = self._downloads.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._downloads.pop(key, None)
+
+    @staticmethod
+    def _disk_size(entry: dict) -> int:
+        paths = [entry['path']] if entry['state'] == STATE_COMPLETE else [entry['path'] + '.part', entry['path'] + '.part.json']
+        size = 0
+        for path in paths:
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+
+    def evict(self) -> int:
+        """Delete least recently used unpinned files until the cache fits max_bytes"""
+        entries = DB.list_audio_cache()
+        sizes = [self._disk_size(entry) for entry in entries]
+        total = sum(sizes)
+        removed = 0
+
+        for entry, size in zip(entries, sizes):
+            if total <= self.max_bytes:
+                break
+            with self._lock:
+                if entry['cache_key'] in self._pins:
+                    continue
+            for path in (entry['path'], entry['path'] + '.part', entry['path'] + '.part.json'):
+                if os.path.exists(path):
+                    os.remove(path)
+            DB.delete_audio_cache(entry['cache_key'])
+            total -= size
+            removed += 1
+            logger.info(f"Evicted cached audio {os.path.basename(entry['path'])} ({size / (1024*1024):.1f} MB)")
+
+        if total > self.max_bytes:
+            logger.warning(f"Audio cache is over budget ({total / (1024*1024):.1f} MB) but remaining files are in use")
+        return removed
+
+
+# Глобальный кэш аудио
+audio_cache = AudioCache(Config.AUDIO_CACHE_DIR, Config.AUDIO_CACHE_MAX_BYTES)
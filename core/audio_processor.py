@@ -1,95 +1,320 @@
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from core.audio_cache import audio_cache
 from core.config import Config
+from utils.http_client import http_client
 from utils.proxy_manager import proxy_manager
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
 
 
-def download_episode(audio_url: str, episode_title: str, timeout: int = 90, max_proxy_retries: int = 3) -> str:
+def partial_download_size(audio_url: str) -> int:
+    """Bytes already downloaded into the episode's .part file"""
+    part_path = audio_cache.path_for(audio_url) + '.part'
+    # Сегментный .part заранее занимает полный размер — прогресс хранится в checkpoint
+    try:
+        with open(part_path + '.json', 'r') as f:
+            segments = json.load(f).get('segments')
+        if segments:
+            return sum(done for _, _, done in segments)
+    except (OSError, ValueError):
+        pass
+    try:
+        return os.path.getsize(part_path)
+    except OSError:
+        return 0
+
+
+def _load_checkpoint(checkpoint_path: str, audio_url: str) -> Optional[dict]:
+    try:
+        with open(checkpoint_path, 'r') as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return checkpoint if checkpoint.get('url') == audio_url else None
+
+
+def _save_checkpoint(checkpoint_path: str, checkpoint: dict) -> None:
+    tmp_path = checkpoint_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def _resume_validator(checkpoint: dict) -> Optional[str]:
+    """Validator for If-Range (weak ETags are not allowed there)"""
+    etag = checkpoint.get('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return checkpoint.get('last_modified')
+
+
+def _download_to_part(audio_url: str, part_path: str, proxies: Optional[dict]) -> int:
     """
-    Download episode with proxy rotation support
+    Download into part_path, resuming from its current size when the server
+    supports ranges and the file hasn't changed. Returns total bytes on disk.
     """
-    for proxy_attempt in range(max_proxy_retries):
-        # Получаем прокси (если включено)
-        proxies = None
-        if Config.USE_PROXY:
-            proxies = proxy_manager.get_proxy()
-            if proxies:
-                proxy_host = list(proxies.values())[0]
-                logger.info(f"Attempt {proxy_attempt + 1}/{max_proxy_retries} with proxy: {proxy_host}")
-            else:
-                logger.warning("No working proxies available, downloading without proxy")
-        
-        # Настройка session
-        session = requests.Session()
-        retry_strategy = Retry(
-            total=2,  # Меньше retry для каждого прокси
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504],
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        session.mount("http://", adapter)
-        session.mount("https://", adapter)
-        
+    checkpoint_path = part_path + '.json'
+    checkpoint = _load_checkpoint(checkpoint_path, audio_url) if os.path.exists(part_path) else None
+    if checkpoint and checkpoint.get('segments'):
+        # .part от сегментной загрузки заранее занимает полный размер — его размер не прогресс
+        logger.info("Segmented download can't be resumed as a single stream, restarting")
+        checkpoint = None
+    offset = os.path.getsize(part_path) if checkpoint else 0
+
+    headers = {}
+    validator = _resume_validator(checkpoint) if checkpoint else None
+    if offset and validator:
+        headers['Range'] = f'bytes={offset}-'
+        headers['If-Range'] = validator
+        logger.info(f"Resuming download from {offset / (1024*1024):.2f} MB")
+    else:
+        offset = 0
+
+    response = http_client.get(
+        audio_url,
+        policy='download',
+        stream=True,
+        headers=headers,
+        proxies=proxies
+    )
+    response.raise_for_status()
+
+    content_range = response.headers.get('Content-Range', '')
+    if offset and response.status_code == 206 and content_range.startswith(f'bytes {offset}-'):
+        mode = 'ab'
+        total_size = int(content_range.rsplit('/', 1)[-1]) if not content_range.endswith('/*') else 0
+    else:
+        if offset:
+            logger.info("Server ignored range request or file changed, restarting download")
+        offset = 0
+        mode = 'wb'
+        total_size = int(response.headers.get('content-length', 0))
+        _save_checkpoint(checkpoint_path, {
+            'url': audio_url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'total_size': total_size,
+        })
+
+    downloaded = offset
+    logger.info(f"Starting download: {total_size / (1024*1024):.2f} MB")
+
+    with open(part_path, mode) as f:
+        for chunk in response.iter_content(chunk_size=Config.DOWNLOAD_CHUNK_SIZE):
+            if chunk:
+                f.write(chunk)
+                downloaded += len(chunk)
+                if total_size > 0 and downloaded % (1024 * 1024 * 10) < len(chunk):  # Каждые ~10MB
+                    progress = (downloaded / total_size) * 100
+                    logger.debug(f"Download progress: {progress:.1f}%")
+
+    if total_size and downloaded < total_size:
+        raise requests.exceptions.ConnectionError(
+            f"Connection closed at {downloaded} of {total_size} bytes")
+    return downloaded
+
+
+def _probe_ranges(audio_url: str, proxies: Optional[dict]) -> Optional[dict]:
+    """Check Content-Length/range support with a one-byte range request"""
+    response = http_client.get(
+        audio_url,
+        policy='download',
+        stream=True,
+        headers={'Range': 'bytes=0-0'},
+        proxies=proxies
+    )
+    response.close()
+    response.raise_for_status()
+
+    content_range = response.headers.get('Content-Range', '')
+    if response.status_code != 206 or not content_range.startswith('bytes 0-0/') or content_range.endswith('/*'):
+        return None
+    return {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'total_size': int(content_range.rsplit('/', 1)[-1]),
+    }
+
+
+def _download_segmented(audio_url: str, part_path: str, probe: dict, proxies: Optional[dict]) -> int:
+    """
+    Fetch byte ranges concurrently into a preallocated .part file.
+
+    Progress of every segment is stored in the checkpoint, so a failed run
+    only re-fetches the missing tail of each segment.
+    """
+    checkpoint_path = part_path + '.json'
+    total_size = probe['total_size']
+    checkpoint = _load_checkpoint(checkpoint_path, audio_url) if os.path.exists(part_path) else None
+    if not (checkpoint and checkpoint.get('segments')
+            and checkpoint.get('total_size') == total_size
+            and checkpoint.get('etag') == probe['etag']
+            and checkpoint.get('last_modified') == probe['last_modified']
+            and os.path.getsize(part_path) == total_size):
+        segment_size = -(-total_size // Config.DOWNLOAD_SEGMENTS)
+        checkpoint = dict(probe, url=audio_url, segments=[
+            [start, min(start + segment_size, total_size) - 1, 0]
+            for start in range(0, total_size, segment_size)
+        ])
+        with open(part_path, 'wb') as f:
+            f.truncate(total_size)
+
+    validator = _resume_validator(checkpoint)
+    pending = [segment for segment in checkpoint['segments'] if segment[0] + segment[2] <= segment[1]]
+    lock = threading.Lock()
+    saved_at = [sum(done for _, _, done in checkpoint['segments'])]
+    logger.info(f"Starting segmented download: {total_size / (1024*1024):.2f} MB, "
+                f"{len(pending)} of {len(checkpoint['segments'])} segments left")
+
+    def fetch_segment(segment: list) -> None:
+        start, end, _ = segment
+        segment_proxies = proxies
+        if Config.USE_PROXY and Config.DOWNLOAD_SEGMENT_PROXIES:
+            segment_proxies = proxy_manager.get_proxy() or proxies
+
+        headers = {'Range': f'bytes={start + segment[2]}-{end}'}
+        if validator:
+            headers['If-Range'] = validator
         try:
-            response = session.get(
-                audio_url,
-                stream=True,
-                timeout=(30, 90),  # (connect timeout, read timeout)
-                headers={
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-                },
-                proxies=proxies
-            )
+            response = http_client.get(audio_url, policy='download', stream=True, headers=headers, proxies=segment_proxies)
             response.raise_for_status()
+            if response.status_code != 206:
+                raise requests.exceptions.ConnectionError(f"Range request for segment {start} was not honoured")
+
+            with open(part_path, 'r+b') as f:
+                f.seek(start + segment[2])
+                for chunk in response.iter_content(chunk_size=Config.DOWNLOAD_CHUNK_SIZE):
+                    if not chunk:
+                        continue
+                    f.write(chunk)
+                    with lock:
+                        segment[2] += len(chunk)
+                        done = sum(part[2] for part in checkpoint['segments'])
+                        # Сохраняем прогресс примерно каждые 16 MB
+                        if done - saved_at[0] >= 16 * 1024 * 1024:
+                            f.flush()
+                            _save_checkpoint(checkpoint_path, checkpoint)
+                            saved_at[0] = done
+        except Exception:
+            if segment_proxies and segment_proxies is not proxies:
+                proxy_manager.mark_proxy_as_failed(segment_proxies['http'])
+            raise
+
+        if start + segment[2] <= end:
+            raise requests.exceptions.ConnectionError(
+                f"Segment {start}-{end} closed at {start + segment[2]}")
+        if segment_proxies and segment_proxies is not proxies:
+            proxy_manager.record_success(segment_proxies['http'])
+
+    errors = []
+    try:
+        with ThreadPoolExecutor(max_workers=len(pending) or 1, thread_name_prefix="download-segment") as executor:
+            for future in [executor.submit(fetch_segment, segment) for segment in pending]:
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append(e)
+    finally:
+        with lock:
+            _save_checkpoint(checkpoint_path, checkpoint)
+
+    if errors:
+        raise errors[0]
+    return total_size
+
+
+def _download(audio_url: str, part_path: str, proxies: Optional[dict]) -> int:
+    """Pick segmented or single-stream download (resuming whichever was started)"""
+    checkpoint = _load_checkpoint(part_path + '.json', audio_url) if os.path.exists(part_path) else None
+    if checkpoint and not checkpoint.get('segments'):
+        return _download_to_part(audio_url, part_path, proxies)
+
+    if Config.DOWNLOAD_SEGMENTS > 1:
+        probe = _probe_ranges(audio_url, proxies)
+        if probe and probe['total_size'] >= Config.DOWNLOAD_SEGMENTED_MIN_BYTES:
+            return _download_segmented(audio_url, part_path, probe, proxies)
+        logger.debug("Server doesn't support ranges or file is small, using single stream")
+
+    return _download_to_part(audio_url, part_path, proxies)
+
+
+def download_episode(audio_url: str, episode_title: str, timeout: int = 90, max_proxy_retries: int = 3) -> str:
+    """
+    Download episode with proxy rotation support.
+
+    Files live in the audio cache keyed by URL: a repeated request for the
+    same audio_url is served from disk. Data is written to a .part file with
+    a sidecar checkpoint, so the next attempt (or the next proxy) continues
+    where the previous one stopped.
+    """
+    cached = audio_cache.lookup(audio_url)
+    if cached:
+        logger.info(f"✓ Using cached audio for: {episode_title[:60]}")
+        return cached
+
+    os.makedirs(audio_cache.directory, exist_ok=True)
+    # Файл в процессе загрузки не должен попасть под вытеснение, а одну и ту же
+    # ссылку (эпизод в двух фидах) не должны качать два потока в один .part
+    with audio_cache.pinned(audio_url), audio_cache.downloading(audio_url):
+        cached = audio_cache.lookup(audio_url)
+        if cached:
+            logger.info(f"✓ Audio was downloaded by another job meanwhile: {episode_title[:60]}")
+            return cached
+
+        filename = audio_cache.start(audio_url)
+        part_path = filename + '.part'
+
+        for proxy_attempt in range(max_proxy_retries):
+            # Получаем прокси (если включено)
+            proxies = None
+            if Config.USE_PROXY:
+                proxies = proxy_manager.get_proxy()
+                if proxies:
+                    proxy_host = list(proxies.values())[0]
+                    logger.info(f"Attempt {proxy_attempt + 1}/{max_proxy_retries} with proxy: {proxy_host}")
+                else:
+                    logger.warning("No working proxies available, downloading without proxy")
+        
+            try:
+                downloaded = _download(audio_url, part_path, proxies)
+
+                # Файл полностью скачан — переносим на место и удаляем checkpoint
+                os.replace(part_path, filename)
+                if os.path.exists(part_path + '.json'):
+                    os.remove(part_path + '.json')
+                audio_cache.complete(audio_url, filename)
+                if proxies:
+                    proxy_manager.record_success(proxies['http'])
+
+                logger.info(f"✓ Successfully downloaded {downloaded / (1024*1024):.2f} MB")
+                return filename
             
-            # Сохранение файла
-            filename = f"downloads/{episode_title[:50].replace('/', '_').replace(':', '_')}.mp3"
-            os.makedirs("downloads", exist_ok=True)
-            
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded = 0
-            
-            logger.info(f"Starting download: {total_size / (1024*1024):.2f} MB")
-            
-            with open(filename, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        if total_size > 0 and downloaded % (1024 * 1024 * 10) < 8192:  # Каждые ~10MB
-                            progress = (downloaded / total_size) * 100
-                            logger.debug(f"Download progress: {progress:.1f}%")
-            
-            logger.info(f"✓ Successfully downloaded {downloaded / (1024*1024):.2f} MB")
-            session.close()
-            return filename
-            
-        except (requests.exceptions.Timeout, 
-                requests.exceptions.ConnectionError, 
-                requests.exceptions.ProxyError) as e:
+            except (requests.exceptions.Timeout, 
+                    requests.exceptions.ConnectionError, 
+                    requests.exceptions.ProxyError,
+                    requests.exceptions.ChunkedEncodingError) as e:
             
-            error_type = type(e).__name__
-            logger.warning(f"✗ Download failed with {error_type}: {e}")
+                error_type = type(e).__name__
+                logger.warning(f"✗ Download failed with {error_type}: {e} "
+                               f"(kept {partial_download_size(audio_url) / (1024*1024):.2f} MB for resume)")
             
-            # Если используем прокси и он не сработал, пробуем следующий
-            if Config.USE_PROXY and proxies and proxy_attempt < max_proxy_retries - 1:
-                if proxy_manager.current_proxy:
-                    proxy_manager.mark_proxy_as_failed(proxy_manager.current_proxy)
-                logger.info(f"Switching to next proxy...")
-                continue
-            else:
-                raise Exception(f"Download failed after {proxy_attempt + 1} attempts: {e}")
-        
-        except Exception as e:
-            logger.error(f"Unexpected error during download: {e}")
-            raise
+                # Если используем прокси и он не сработал, пробуем следующий
+                if Config.USE_PROXY and proxies:
+                    proxy_manager.mark_proxy_as_failed(proxies['http'])
+                if Config.USE_PROXY and proxies and proxy_attempt < max_proxy_retries - 1:
+                    logger.info(f"Switching to next proxy...")
+                    continue
+                else:
+                    raise Exception(f"Download failed after {proxy_attempt + 1} attempts: {e}")
         
-        finally:
-            session.close()
+            except Exception as e:
+                logger.error(f"Unexpected error during download: {e}")
+                raise
     
-    raise Exception(f"Failed to download after {max_proxy_retries} proxy attempts")
\ No newline at end of file
+        raise Exception(f"Failed to download after {max_proxy_retries} proxy attempts")
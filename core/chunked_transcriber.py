@@ -0,0 +1,188 @@
+# chunked_transcriber.py
+"""
+Parallel transcription of long episodes.
+
+Audio is split at the quietest points near every chunk boundary, each
+chunk (plus a little overlap on both sides for context) is transcribed
+in a process pool with one Whisper model per worker, and the results are
+stitched back together: every word is kept only from the chunk whose
+"own" range contains its start time, so overlap regions aren't duplicated.
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from core.config import Config
+from core.model_registry import model_registry
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+SAMPLE_RATE = 16000  # whisper.audio.SAMPLE_RATE
+FRAME_SAMPLES = SAMPLE_RATE // 10  # 100 мс кадры для поиска тишины
+
+
+def quietest_point(audio: np.ndarray, start: int, end: int) -> int:
+    """Sample index of the lowest-energy 100 ms frame in audio[start:end]"""
+    window = audio[start:end]
+    frames = len(window) // FRAME_SAMPLES
+    if frames == 0:
+        return (start + end) // 2
+    energy = np.square(window[:frames * FRAME_SAMPLES].reshape(frames, FRAME_SAMPLES)).mean(axis=1)
+    return start + int(np.argmin(energy)) * FRAME_SAMPLES + FRAME_SAMPLES // 2
+
+
+def plan_chunks(audio: np.ndarray, chunk_seconds: float, overlap_seconds: float, search_seconds: float) -> list:
+    """
+    Split audio into chunks at silence boundaries.
+
+    Returns a list of (start, end, keep_from, keep_to) sample indexes: the
+    chunk audio is audio[start:end], its words are kept in [keep_from, keep_to).
+    """
+    total = len(audio)
+    chunk = int(chunk_seconds * SAMPLE_RATE)
+    overlap = int(overlap_seconds * SAMPLE_RATE)
+    search = int(search_seconds * SAMPLE_RATE)
+
+    splits = [0]
+    target = chunk
+    # Последний кусок не делаем короче четверти обычного
+    while target < total - chunk // 4:
+        low = max(splits[-1] + FRAME_SAMPLES, target - search)
+        high = min(total, target + search)
+        splits.append(quietest_point(audio, low, high))
+        target = splits[-1] + chunk
+    splits.append(total)
+
+    return [
+        (max(0, keep_from - overlap), min(total, keep_to + overlap), keep_from, keep_to)
+        for keep_from, keep_to in zip(splits, splits[1:])
+    ]
+
+
+def shift_result(result: dict, offset: float) -> dict:
+    """Move segment and word timestamps by offset seconds (in place)"""
+    if not offset:
+        return result
+    for segment in result.get('segments', []):
+        segment['start'] += offset
+        segment['end'] += offset
+        for word in segment.get('words') or []:
+            word['start'] += offset
+            word['end'] += offset
+    return result
+
+
+def stitch_results(parts: list) -> dict:
+    """
+    Merge chunk results into one Whisper-style result.
+
+    parts: list of (result with absolute timestamps, keep_from, keep_to) in seconds.
+    """
+    segments = []
+    for result, keep_from, keep_to in parts:
+        for segment in result.get('segments', []):
+            words = segment.get('words')
+            if words:
+                kept = [word for word in words if keep_from <= word['start'] < keep_to]
+                if not kept:
+                    continue
+                if len(kept) != len(words):
+                    segment = dict(segment, words=kept, start=kept[0]['start'], end=kept[-1]['end'],
+                                   text=''.join(word['word'] for word in kept))
+            elif not keep_from <= segment['start'] < keep_to:
+                continue
+            segments.append(dict(segment, id=len(segments)))
+
+    language = parts[0][0].get('language') if parts else None
+    return {
+        'text': ''.join(segment['text'] for segment in segments),
+        'segments': segments,
+        'language': language,
+    }
+
+
+# --- Процессы-воркеры -----------------------------------------------------
+
+_worker_model_key = None
+
+
+def _init_worker(model_key: tuple, threads: int) -> None:
+    """Load one model per worker process"""
+    global _worker_model_key
+    import torch
+    torch.set_num_threads(threads)
+    _worker_model_key = model_key
+    model_registry.get(*model_key)
+
+
+def _transcribe_chunk(audio: np.ndarray, offset: float, options: dict) -> dict:
+    result = model_registry.transcribe(audio, *_worker_model_key, **options)
+    return shift_result(result, offset)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            model_key = (Config.WHISPER_MODEL, Config.WHISPER_DEVICE or None, Config.WHISPER_COMPUTE_TYPE)
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            logger.info(f"Starting transcription pool: {workers} workers x {threads} threads")
+            # spawn: fork после загрузки torch в родителе может зависнуть
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(model_key, threads),
+            )
+        return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+atexit.register(shutdown_pool)
+
+
+def transcribe_chunked(audio: np.ndarray, options: dict, workers: int = None) -> dict:
+    """Transcribe 16 kHz mono audio in parallel chunks and stitch the result"""
+    workers = workers or Config.TRANSCRIBE_WORKERS
+    duration = len(audio) / SAMPLE_RATE
+    # Не меньше одного куска на воркер, чтобы загрузить все ядра
+    chunk_seconds = min(Config.TRANSCRIBE_CHUNK_SECONDS, max(duration / workers, 30))
+    chunks = plan_chunks(audio, chunk_seconds, Config.TRANSCRIBE_CHUNK_OVERLAP, Config.TRANSCRIBE_SPLIT_SEARCH)
+    logger.info(f"Transcribing {duration / 60:.1f} min in {len(chunks)} chunks on {workers} workers")
+
+    pool = _get_pool(workers)
+    try:
+        futures = [
+            pool.submit(_transcribe_chunk, audio[start:end], start / SAMPLE_RATE, options)
+            for start, end, _, _ in chunks
+        ]
+        results = [future.result() for future in futures]
+    except BrokenProcessPool:
+        shutdown_pool()
+        raise
+
+    last = len(chunks) - 1
+    parts = [
+        (result,
+         keep_from / SAMPLE_RATE if index > 0 else float('-inf'),
+         keep_to / SAMPLE_RATE if index < last else float('inf'))
+        for index, (result, (_, _, keep_from, keep_to)) in enumerate(zip(results, chunks))
+    ]
+    return stitch_results(parts)
@@ -21,6 +21,138 @@ class Config:
     # Максимальное количество прокси для тестирования при старте
     MAX_PROXIES_TO_TEST = int(os.getenv('MAX_PROXIES_TO_TEST', '20'))
     
+    # Проверка прокси: адрес для проверки, таймаут, число параллельных проверок
+    # и сколько рабочих прокси достаточно, чтобы закончить проверку досрочно
+    PROXY_TEST_URL = os.getenv('PROXY_TEST_URL', 'http://httpbin.org/ip')
+    PROXY_TEST_TIMEOUT = float(os.getenv('PROXY_TEST_TIMEOUT', '10'))
+    PROXY_TEST_CONCURRENCY = int(os.getenv('PROXY_TEST_CONCURRENCY', '8'))
+    PROXY_MIN_WORKING = int(os.getenv('PROXY_MIN_WORKING', '5'))
+    
+    # Пул прокси: сглаживание EWMA, число неудач подряд до отключения,
+    # cooldown отключённого прокси (удваивается, до максимума) и период фонового обновления пула
+    PROXY_EWMA_ALPHA = float(os.getenv('PROXY_EWMA_ALPHA', '0.3'))
+    PROXY_FAILURE_THRESHOLD = int(os.getenv('PROXY_FAILURE_THRESHOLD', '2'))
+    PROXY_COOLDOWN = float(os.getenv('PROXY_COOLDOWN', '300'))
+    PROXY_MAX_COOLDOWN = float(os.getenv('PROXY_MAX_COOLDOWN', '3600'))
+    PROXY_REFRESH_INTERVAL = float(os.getenv('PROXY_REFRESH_INTERVAL', '60'))
+    
+    # Общий HTTP-клиент: размер пула соединений на хост (и на прокси)
+    HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '16'))
+    
+    # Загрузка эпизодов: размер чанка, число параллельных диапазонов (1 — один поток),
+    # минимальный размер файла для сегментной загрузки и отдельный прокси на сегмент
+    DOWNLOAD_CHUNK_SIZE = int(os.getenv('DOWNLOAD_CHUNK_SIZE', str(1024 * 1024)))
+    DOWNLOAD_SEGMENTS = int(os.getenv('DOWNLOAD_SEGMENTS', '4'))
+    DOWNLOAD_SEGMENTED_MIN_BYTES = int(os.getenv('DOWNLOAD_SEGMENTED_MIN_BYTES', str(16 * 1024 * 1024)))
+    DOWNLOAD_SEGMENT_PROXIES = os.getenv('DOWNLOAD_SEGMENT_PROXIES', 'false').lower() == 'true'
+    
+    # Кэш скачанного аудио: каталог и лимит размера (LRU-вытеснение)
+    AUDIO_CACHE_DIR = os.getenv('AUDIO_CACHE_DIR', 'downloads')
+    AUDIO_CACHE_MAX_BYTES = int(os.getenv('AUDIO_CACHE_MAX_BYTES', str(5 * 1024 * 1024 * 1024)))
+    
+    # Пайплайн: сколько эпизодов обрабатывать за запуск, воркеры каждой стадии
+    # и размер очередей между стадиями (ограничивает число скачанных, но не обработанных эпизодов)
+    PIPELINE_EPISODES = int(os.getenv('PIPELINE_EPISODES', '3'))
+    PIPELINE_DOWNLOAD_WORKERS = int(os.getenv('PIPELINE_DOWNLOAD_WORKERS', '2'))
+    # Транскрибация в процессе идёт по одной за раз (общая модель Whisper не потокобезопасна),
+    # поэтому больше одного воркера имеет смысл только с пулом процессов (TRANSCRIBE_WORKERS > 1)
+    PIPELINE_TRANSCRIBE_WORKERS = int(os.getenv('PIPELINE_TRANSCRIBE_WORKERS', '1'))
+    PIPELINE_SUMMARIZE_WORKERS = int(os.getenv('PIPELINE_SUMMARIZE_WORKERS', '2'))
+    PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '2'))
+    
+    # Повтор эпизода после ошибки: первая пауза (удваивается с каждой попыткой) и максимум, в секундах
+    JOB_RETRY_BASE = float(os.getenv('JOB_RETRY_BASE', '600'))
+    JOB_RETRY_MAX = float(os.getenv('JOB_RETRY_MAX', str(24 * 3600)))
+    
+    # Параллельная загрузка RSS: общий лимит потоков, лимит на один хост
+    # и пауза между запросами к одному и тому же хосту (в секундах)
+    FETCH_CONCURRENCY = int(os.getenv('FETCH_CONCURRENCY', '8'))
+    FETCH_PER_HOST_CONCURRENCY = int(os.getenv('FETCH_PER_HOST_CONCURRENCY', '1'))
+    FETCH_HOST_DELAY = float(os.getenv('FETCH_HOST_DELAY', '3'))
+    
+    # Сколько самых новых эпизодов читать из фида (остальное не скачивается)
+    FEED_MAX_ENTRIES = int(os.getenv('FEED_MAX_ENTRIES', '10'))
+    FEED_STREAM_CHUNK_SIZE = int(os.getenv('FEED_STREAM_CHUNK_SIZE', str(64 * 1024)))
+    
+    # SQLite: ожидание блокировки (мс), уровень synchronous для WAL и размер кэша подготовленных запросов
+    DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', '30000'))
+    DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'NORMAL').upper()
+    DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', '256'))
+    
+    # Whisper: модель, устройство (пусто — автоматически), тип вычислений (float32/float16)
+    WHISPER_MODEL = os.getenv('WHISPER_MODEL', 'base.en')
+    WHISPER_DEVICE = os.getenv('WHISPER_DEVICE', '')
+    WHISPER_COMPUTE_TYPE = os.getenv('WHISPER_COMPUTE_TYPE', 'float32')
+    # Выгружать модель после простоя (секунды, 0 — держать в памяти всегда)
+    WHISPER_MODEL_TTL = float(os.getenv('WHISPER_MODEL_TTL', '0'))
+    # Загрузить модель при старте приложения
+    WHISPER_PRELOAD = os.getenv('WHISPER_PRELOAD', 'true').lower() == 'true'
+    
+    # Параллельная транскрибация длинных эпизодов кусками (1 — выключено)
+    TRANSCRIBE_WORKERS = int(os.getenv('TRANSCRIBE_WORKERS', '1'))
+    TRANSCRIBE_PARALLEL_MIN_SECONDS = float(os.getenv('TRANSCRIBE_PARALLEL_MIN_SECONDS', '1200'))
+    TRANSCRIBE_CHUNK_SECONDS = float(os.getenv('TRANSCRIBE_CHUNK_SECONDS', '600'))
+    TRANSCRIBE_CHUNK_OVERLAP = float(os.getenv('TRANSCRIBE_CHUNK_OVERLAP', '5'))
+    # Окно (± секунды) вокруг границы куска, в котором ищем паузу
+    TRANSCRIBE_SPLIT_SEARCH = float(os.getenv('TRANSCRIBE_SPLIT_SEARCH', '30'))
+    
+    # Потоковый режим: транскрибация во время скачивания, без файла на диске.
+    # Размер чанка и максимальный объём декодированного аудио в памяти (секунды)
+    STREAM_TRANSCRIBE = os.getenv('STREAM_TRANSCRIBE', 'false').lower() == 'true'
+    STREAM_CHUNK_SECONDS = float(os.getenv('STREAM_CHUNK_SECONDS', '300'))
+    STREAM_BUFFER_SECONDS = float(os.getenv('STREAM_BUFFER_SECONDS', '1800'))
+    # Сколько раз переподключаться с места обрыва, если сервер закрыл соединение
+    STREAM_RECONNECTS = int(os.getenv('STREAM_RECONNECTS', '5'))
+    
+    # VAD: вырезать тишину и музыку перед Whisper
+    VAD_ENABLED = os.getenv('VAD_ENABLED', 'true').lower() == 'true'
+    VAD_FRAME_MS = int(os.getenv('VAD_FRAME_MS', '30'))
+    # Порог речи: на сколько дБ выше шумового фона, но не ниже абсолютного минимума
+    VAD_THRESHOLD_DB = float(os.getenv('VAD_THRESHOLD_DB', '12'))
+    VAD_MIN_ENERGY_DB = float(os.getenv('VAD_MIN_ENERGY_DB', '-50'))
+    VAD_PAD_MS = int(os.getenv('VAD_PAD_MS', '300'))
+    # Вырезаются только паузы длиннее VAD_MIN_SILENCE секунд
+    VAD_MIN_SILENCE = float(os.getenv('VAD_MIN_SILENCE', '1.5'))
+    VAD_MIN_SPEECH = float(os.getenv('VAD_MIN_SPEECH', '0.25'))
+    VAD_MUSIC_FILTER = os.getenv('VAD_MUSIC_FILTER', 'true').lower() == 'true'
+    VAD_MUSIC_LOW_ENERGY_RATIO = float(os.getenv('VAD_MUSIC_LOW_ENERGY_RATIO', '0.1'))
+    
+    # Кэш транскриптов (ключ — хэш аудио + модель и опции)
+    TRANSCRIPT_CACHE_DIR = os.getenv('TRANSCRIPT_CACHE_DIR', 'cache/transcripts')
+    TRANSCRIPT_CACHE_MAX_BYTES = int(os.getenv('TRANSCRIPT_CACHE_MAX_BYTES', str(500 * 1024 * 1024)))
+    
+    # LLM для саммари: адреса OpenAI-совместимых API, токены и таймауты провайдеров
+    GROQ_API_URL = os.getenv('GROQ_API_URL', 'https://api.groq.com/openai/v1/chat/completions')
+    GROQ_TOKEN = os.getenv('GROQ_TOKEN')
+    GROQ_TIMEOUT = float(os.getenv('GROQ_TIMEOUT', '60'))
+    HF_API_URL = os.getenv('HF_API_URL', 'https://router.huggingface.co/v1/chat/completions')
+    HF_TOKEN = os.getenv('HF_TOKEN')
+    HF_TIMEOUT = float(os.getenv('HF_TIMEOUT', '120'))
+    # Через сколько секунд без ответа основного провайдера параллельно спросить запасной
+    LLM_HEDGE_DELAY = float(os.getenv('LLM_HEDGE_DELAY', '20'))
+    LLM_EWMA_ALPHA = float(os.getenv('LLM_EWMA_ALPHA', '0.3'))
+    # Сколько ошибок подряд, чтобы провайдер перестал быть основным
+    LLM_FAILURE_THRESHOLD = int(os.getenv('LLM_FAILURE_THRESHOLD', '3'))
+    LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '10'))
+    # Лимиты провайдеров: запросов и токенов в минуту (0 — без ограничения)
+    GROQ_RPM = int(os.getenv('GROQ_RPM', '30'))
+    GROQ_TPM = int(os.getenv('GROQ_TPM', '8000'))
+    HF_RPM = int(os.getenv('HF_RPM', '60'))
+    HF_TPM = int(os.getenv('HF_TPM', '0'))
+    # Сколько раз повторять запрос после 429 и пауза, если сервер не прислал retry-after (с)
+    LLM_RATE_LIMIT_RETRIES = int(os.getenv('LLM_RATE_LIMIT_RETRIES', '5'))
+    LLM_DEFAULT_RETRY_AFTER = float(os.getenv('LLM_DEFAULT_RETRY_AFTER', '10'))
+    
+    # Саммари длинных транскриптов: размер куска в токенах (map-reduce, если транскрипт длиннее)
+    # и сколько кусков суммаризировать одновременно
+    TOKENIZER_ENCODING = os.getenv('TOKENIZER_ENCODING', 'o200k_base')
+    SUMMARY_CHUNK_TOKENS = int(os.getenv('SUMMARY_CHUNK_TOKENS', '6000'))
+    SUMMARY_MAP_CONCURRENCY = int(os.getenv('SUMMARY_MAP_CONCURRENCY', '4'))
+    
+    # Кэш саммари в БД: время жизни (с) и лимит размера
+    SUMMARY_CACHE_TTL = float(os.getenv('SUMMARY_CACHE_TTL', str(30 * 24 * 3600)))
+    SUMMARY_CACHE_MAX_BYTES = int(os.getenv('SUMMARY_CACHE_MAX_BYTES', str(50 * 1024 * 1024)))
+    
     @staticmethod
     def get_proxies() -> Optional[dict]:
         """Get proxy configuration (deprecated - use ProxyManager instead)"""
@@ -0,0 +1,349 @@
+# llm_client.py
+"""
+Async client for OpenAI-compatible chat completion APIs (Groq, HuggingFace).
+
+All requests run on one background event loop over a pooled aiohttp
+session, so connections to the providers are reused between summaries.
+Each provider has a strict timeout. A request is hedged: if the primary
+provider hasn't answered within LLM_HEDGE_DELAY seconds (or has already
+failed), the next provider is asked as well and the first good answer
+wins. The provider with the lowest EWMA latency among healthy ones is
+primary.
+
+Every provider also has a token-bucket rate limiter for requests and
+tokens per minute. A request's token cost (prompt plus max_tokens) is
+estimated with tiktoken before sending, and the request waits for
+capacity instead of being fired into a 429. The buckets follow the
+provider's x-ratelimit-* headers, and a 429 pauses the provider for
+retry-after seconds and queues the request again.
+
+Usage (from synchronous code):
+    text = llm_client.complete(prompt)
+    text = llm_client.complete(prompt, providers=['groq'])
+"""
+import asyncio
+import re
+import threading
+import time
+from typing import Optional
+
+import aiohttp
+
+from core.config import Config
+from core.tokens import count_tokens
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse '7.66s', '2m59.56s', '120ms' or plain seconds into seconds"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PART.findall(value)
+    if not parts:
+        return None
+    scale = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount is available (call after refill)"""
+        if self.unlimited or self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.capacity
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets of one provider"""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.paused_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self, tokens: int) -> float:
+        """Wait until the request fits into both buckets, returns the time waited"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        started = time.monotonic()
+        # Под замком — ожидающие запросы обслуживаются по очереди
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.requests.refill(now)
+                self.tokens.refill(now)
+                # Запрос больше ёмкости ведра ждал бы вечно — ограничиваем ёмкостью
+                cost = min(tokens, self.tokens.capacity) if not self.tokens.unlimited else 0
+                wait = max(self.paused_until - now, self.requests.wait_time(1), self.tokens.wait_time(cost))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            if not self.requests.unlimited:
+                self.requests.level -= 1
+            self.tokens.level -= cost
+        return time.monotonic() - started
+
+    def update(self, headers) -> None:
+        """Follow the provider's own view of the limits from x-ratelimit-* headers"""
+        now = time.monotonic()
+        for kind, bucket in (('requests', self.requests), ('tokens', self.tokens)):
+            remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+            if remaining is None:
+                continue
+            try:
+                remaining = float(remaining)
+            except ValueError:
+                continue
+            if kind == 'tokens':
+                try:
+                    bucket.capacity = float(headers.get('x-ratelimit-limit-tokens', bucket.capacity))
+                except ValueError:
+                    pass
+            bucket.refill(now)
+            bucket.level = min(bucket.level, remaining)
+            if remaining < 1:
+                reset = parse_duration(headers.get(f'x-ratelimit-reset-{kind}'))
+                if reset:
+                    self.paused_until = max(self.paused_until, now + reset)
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class Provider:
+    def __init__(self, name: str, url: str, token: Optional[str], model: str, system_prompt: str,
+                 timeout: float, params: Optional[dict] = None, rpm: int = 0, tpm: int = 0):
+        self.name = name
+        self.url = url
+        self.token = token
+        self.model = model
+        self.system_prompt = system_prompt
+        self.timeout = timeout
+        self.params = params or {}
+        self.limiter = RateLimiter(rpm, tpm)
+        # Статистика: EWMA задержки успешных ответов и число ошибок подряд
+        self.latency: Optional[float] = None
+        self.failures = 0
+
+    @property
+    def healthy(self) -> bool:
+        return self.failures < Config.LLM_FAILURE_THRESHOLD
+
+    def estimate_tokens(self, prompt: str) -> int:
+        """Tokens the request counts against TPM: prompt plus the answer budget"""
+        return count_tokens(self.system_prompt) + count_tokens(prompt) + self.params.get("max_tokens", 0)
+
+    def payload(self, prompt: str) -> dict:
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            **self.params
+        }
+
+
+class LLMClient:
+    def __init__(self, providers: list, hedge_delay: float):
+        self.providers = {provider.name: provider for provider in providers}
+        self.hedge_delay = hedge_delay
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._lock = threading.Lock()
+
+    # --- Фоновый event loop ---
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or not self._thread.is_alive():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="llm-client", daemon=True)
+                self._thread.start()
+        return self._loop
+
+    def run(self, coroutine):
+        """Run a coroutine on the client's loop and wait for the result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._ensure_loop()).result()
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=Config.LLM_MAX_CONNECTIONS, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    def close(self) -> None:
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), loop).result(timeout=5)
+            self._session = None
+        loop.call_soon_threadsafe(loop.stop)
+
+    # --- Провайдеры ---
+
+    def ranked(self, names: Optional[list] = None) -> list:
+        """Providers in the order they should be tried: healthy and fastest first"""
+        providers = [self.providers[name] for name in (names or self.providers)]
+        order = {provider.name: index for index, provider in enumerate(providers)}
+        # Непроверенные провайдеры идут после проверенных, между собой — в порядке конфигурации
+        return sorted(providers, key=lambda provider: (
+            not provider.healthy,
+            provider.latency if provider.latency is not None else float('inf'),
+            order[provider.name],
+        ))
+
+    def settings(self, names: Optional[list] = None) -> list:
+        """Model and request parameters of the providers (part of the summary cache key)"""
+        return [
+            {"name": provider.name, "model": provider.model, "system": provider.system_prompt, "params": provider.params}
+            for provider in sorted((self.providers[name] for name in (names or self.providers)), key=lambda p: p.name)
+        ]
+
+    def _record(self, provider: Provider, latency: Optional[float]) -> None:
+        if latency is None:
+            provider.failures += 1
+            return
+        provider.failures = 0
+        self._record_latency(provider, latency)
+
+    @staticmethod
+    def _record_latency(provider: Provider, latency: float) -> None:
+        alpha = Config.LLM_EWMA_ALPHA
+        provider.latency = latency if provider.latency is None else alpha * latency + (1 - alpha) * provider.latency
+
+    async def _call(self, provider: Provider, prompt: str) -> Optional[str]:
+        if not provider.token:
+            logger.debug(f"{provider.name}: no API token configured")
+            return None
+        session = await self._get_session()
+        tokens = provider.estimate_tokens(prompt)
+
+        for attempt in range(Config.LLM_RATE_LIMIT_RETRIES + 1):
+            waited = await provider.limiter.acquire(tokens)
+            if waited >= 1:
+                logger.info(f"⏳ {provider.name}: waited {waited:.1f}s for rate limit (~{tokens} tokens)")
+            started = time.monotonic()
+            try:
+                async with session.post(
+                    provider.url,
+                    headers={"Authorization": f"Bearer {provider.token}"},
+                    json=provider.payload(prompt),
+                    timeout=aiohttp.ClientTimeout(total=provider.timeout, connect=10),
+                ) as response:
+                    provider.limiter.update(response.headers)
+                    if response.status == 429:
+                        # Превысили лимит — ставим провайдера на паузу и повторяем в очереди
+                        retry_after = parse_duration(response.headers.get("retry-after")) or Config.LLM_DEFAULT_RETRY_AFTER
+                        provider.limiter.pause(retry_after)
+                        await response.read()  # дочитываем тело, чтобы соединение вернулось в пул
+                        if attempt < Config.LLM_RATE_LIMIT_RETRIES:
+                            logger.warning(f"⏳ {provider.name} rate limited, retrying in {retry_after:.1f}s "
+                                           f"(retry {attempt + 1}/{Config.LLM_RATE_LIMIT_RETRIES})")
+                        continue
+                    if response.status != 200:
+                        logger.warning(f"✗ {provider.name} returned {response.status}: {(await response.text())[:200]}")
+                        self._record(provider, None)
+                        return None
+                    data = await response.json(content_type=None)
+                content = data["choices"][0]["message"]["content"]
+            except asyncio.CancelledError:
+                # Проиграл хеджированный запрос — провайдер как минимум настолько медленный,
+                # но это не успех: счётчик ошибок не сбрасываем
+                self._record_latency(provider, time.monotonic() - started)
+                raise
+            except asyncio.TimeoutError:
+                logger.warning(f"✗ {provider.name} timed out after {provider.timeout:.0f}s")
+                self._record(provider, None)
+                return None
+            except (aiohttp.ClientError, KeyError, IndexError, TypeError, ValueError) as e:
+                logger.warning(f"✗ {provider.name} request failed: {type(e).__name__}: {e}")
+                self._record(provider, None)
+                return None
+
+            latency = time.monotonic() - started
+            self._record(provider, latency)
+            logger.info(f"✓ {provider.name} answered in {latency:.1f}s")
+            return content or None
+
+        logger.warning(f"✗ {provider.name} still rate limited after {Config.LLM_RATE_LIMIT_RETRIES} retries")
+        self._record(provider, None)
+        return None
+
+    async def complete_async(self, prompt: str, providers: Optional[list] = None) -> Optional[str]:
+        """Hedged request: first good answer from the ranked providers wins"""
+        queue = list(self.ranked(providers))
+        running = {}
+
+        def launch():
+            provider = queue.pop(0)
+            running[asyncio.ensure_future(self._call(provider, prompt))] = provider
+
+        launch()
+        try:
+            while running:
+                done, _ = await asyncio.wait(
+                    running, timeout=self.hedge_delay if queue else None, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Основной провайдер не уложился в бюджет — параллельно спрашиваем следующий
+                    slow = ", ".join(provider.name for provider in running.values())
+                    logger.info(f"⏳ {slow} slower than {self.hedge_delay:.0f}s, hedging with {queue[0].name}")
+                    launch()
+                    continue
+                for task in done:
+                    running.pop(task)
+                    if task.result():
+                        return task.result()
+                    # Провайдер ответил ошибкой — не ждём бюджет, сразу пробуем следующий
+                    if queue:
+                        launch()
+        finally:
+            for task in running:
+                task.cancel()
+        return None
+
+    def complete(self, prompt: str, providers: Optional[list] = None) -> Optional[str]:
+        return self.run(self.complete_async(prompt, providers))
+
+
+# Глобальный клиент LLM
+llm_client = LLMClient([
+    Provider(
+        "groq", Config.GROQ_API_URL, Config.GROQ_TOKEN, "openai/gpt-oss-120b",
+        "Ты эксперт по созданию кратких содержаний подкастов на русском языке.",
+        timeout=Config.GROQ_TIMEOUT, params={"temperature": 0.7, "max_tokens": 1000},
+        rpm=Config.GROQ_RPM, tpm=Config.GROQ_TPM,
+    ),
+    Provider(
+        "huggingface", Config.HF_API_URL, Config.HF_TOKEN, "openai/gpt-oss-120b:cheapest",
+        "Ты эксперт по созданию дайджестов подкастов.",
+        timeout=Config.HF_TIMEOUT, params={"max_tokens": 1500},
+        rpm=Config.HF_RPM, tpm=Config.HF_TPM,
+    ),
+], hedge_delay=Config.LLM_HEDGE_DELAY)
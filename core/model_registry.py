@@ -0,0 +1,135 @@
+# model_registry.py
+"""
+Process-wide cache of loaded Whisper models.
+
+Each (model name, device, compute type) is loaded once and kept warm
+between pipeline runs. Models that haven't been used for `ttl` seconds
+are unloaded by a background janitor thread (ttl <= 0 keeps them forever).
+
+Whisper installs kv-cache hooks on the shared decoder for every decode,
+so two threads must not run one model at once: in-process transcription
+goes through `transcribe()`, which serialises calls per model.
+"""
+import gc
+import threading
+import time
+from typing import Optional
+
+import whisper
+
+from core.config import Config
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class WhisperModelRegistry:
+    def __init__(self, ttl: float = 0):
+        self.ttl = ttl
+        self._models = {}  # key -> {'model': ..., 'last_used': ..., 'lock': ..., 'in_use': ...}
+        self._lock = threading.Lock()
+        self._janitor: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _key(name: Optional[str], device: Optional[str], compute_type: Optional[str]) -> tuple:
+        return (
+            name or Config.WHISPER_MODEL,
+            device or Config.WHISPER_DEVICE or None,
+            compute_type or Config.WHISPER_COMPUTE_TYPE,
+        )
+
+    def _acquire(self, key: tuple, use: bool = False) -> dict:
+        """Entry for key, loading the model on first use (call with the lock held)"""
+        entry = self._models.get(key)
+        if entry is None:
+            model_name, model_device, model_compute_type = key
+            logger.info(f"Loading Whisper model {model_name} (device: {model_device or 'auto'}, "
+                        f"compute type: {model_compute_type})")
+            start_time = time.time()
+            model = whisper.load_model(model_name, device=model_device)
+            logger.info(f"Whisper model {model_name} loaded in {time.time() - start_time:.2f}s")
+            entry = {'model': model, 'last_used': time.monotonic(), 'lock': threading.Lock(), 'in_use': 0}
+            self._models[key] = entry
+            self._start_janitor()
+        entry['last_used'] = time.monotonic()
+        if use:
+            entry['in_use'] += 1
+        return entry
+
+    def get(self, name: Optional[str] = None, device: Optional[str] = None, compute_type: Optional[str] = None):
+        """Return a loaded model, loading it on first use"""
+        with self._lock:
+            return self._acquire(self._key(name, device, compute_type))['model']
+
+    def transcribe(self, audio, name: Optional[str] = None, device: Optional[str] = None,
+                   compute_type: Optional[str] = None, **options) -> dict:
+        """Transcribe with a shared model, one call per model at a time"""
+        with self._lock:
+            # in_use не даёт janitor выгрузить модель посреди долгой транскрибации
+            entry = self._acquire(self._key(name, device, compute_type), use=True)
+        try:
+            with entry['lock']:
+                return entry['model'].transcribe(audio, **options)
+        finally:
+            with self._lock:
+                entry['in_use'] -= 1
+                entry['last_used'] = time.monotonic()
+
+    def preload(self, name: Optional[str] = None, device: Optional[str] = None, compute_type: Optional[str] = None) -> None:
+        """Load a model ahead of time so the first job doesn't pay the cold start"""
+        self.get(name, device, compute_type)
+
+    def unload(self, name: Optional[str] = None, device: Optional[str] = None, compute_type: Optional[str] = None) -> None:
+        with self._lock:
+            entry = self._models.pop(self._key(name, device, compute_type), None)
+        if entry is not None:
+            self._release(entry)
+
+    def unload_idle(self) -> int:
+        """Unload models unused for longer than ttl, returns number of unloaded models"""
+        if self.ttl <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            idle = [key for key, entry in self._models.items()
+                    if not entry['in_use'] and now - entry['last_used'] > self.ttl]
+            entries = [self._models.pop(key) for key in idle]
+        for key, entry in zip(idle, entries):
+            logger.info(f"Unloading idle Whisper model {key[0]} (idle > {self.ttl:.0f}s)")
+            self._release(entry)
+        return len(entries)
+
+    @staticmethod
+    def _release(entry: dict) -> None:
+        entry.clear()
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+
+    def _start_janitor(self) -> None:
+        if self.ttl <= 0 or (self._janitor and self._janitor.is_alive()):
+            return
+        self._janitor = threading.Thread(target=self._janitor_loop, name="whisper-janitor", daemon=True)
+        self._janitor.start()
+
+    def _janitor_loop(self) -> None:
+        interval = min(max(self.ttl / 2, 1), 60)
+        while True:
+            time.sleep(interval)
+            self.unload_idle()
+            with self._lock:
+                if not self._models:
+                    self._janitor = None
+                    return
+
+    def transcribe_options(self, compute_type: Optional[str] = None) -> dict:
+        """Decoding options that depend on the compute type"""
+        return {'fp16': (compute_type or Config.WHISPER_COMPUTE_TYPE) == 'float16'}
+
+
+# Глобальный реестр моделей
+model_registry = WhisperModelRegistry(ttl=Config.WHISPER_MODEL_TTL)
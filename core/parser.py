@@ -1,12 +1,18 @@
 # parser.py
 import requests
 import feedparser
+import hashlib
 import json
+import threading
 import time
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlsplit
 import urllib3
+from core.config import Config
+from core.feed_stream import FeedStream, FeedStreamError
 from data.database import DB
+from utils.http_client import http_client
 from utils.logger import get_logger, log_execution_time
 
 # Get module logger
@@ -15,35 +21,6 @@ logger = get_logger(__name__)
 # Отключаем предупреждения SSL (только для разработки!)
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-def create_session():
-    """Create requests session with retry logic and browser-like headers"""
-    logger.debug("Creating HTTP session with retry strategy")
-    session = requests.Session()
-    
-    # Retry стратегия
-    retry = Retry(
-        total=3,
-        backoff_factor=1,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET"]
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    
-    # Заголовки как у настоящего браузера
-    session.headers.update({
-        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Accept': 'application/rss+xml, application/xml, text/xml, application/atom+xml, */*',
-        'Accept-Language': 'en-US,en;q=0.9',
-        'Accept-Encoding': 'gzip, deflate, br',
-        'Connection': 'keep-alive',
-        'Cache-Control': 'no-cache',
-    })
-    
-    logger.debug("HTTP session created successfully")
-    return session
-
 def load_podcasts_feeds():
     """Load podcasts.json data"""
     logger.debug("Loading podcasts feeds from podcasts.json")
@@ -59,98 +36,228 @@ def load_podcasts_feeds():
         logger.error(f"Invalid JSON in podcasts.json: {e}")
         raise
 
+
+class HostThrottle:
+    """Per-host concurrency limit and politeness delay for feed requests"""
+
+    def __init__(self, per_host_limit: int = 1, delay: float = 3.0):
+        self.per_host_limit = max(1, per_host_limit)
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._next_slot = {}
+
+    @contextmanager
+    def slot(self, url: str):
+        """Wait for a free request slot on the url's host"""
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host_limit)
+                self._semaphores[host] = semaphore
+
+        semaphore.acquire()
+        try:
+            # Резервируем время старта, чтобы запросы к хосту шли не чаще delay
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_slot.get(host, now))
+                self._next_slot[host] = start + self.delay
+            if start > now:
+                time.sleep(start - now)
+            yield
+        finally:
+            semaphore.release()
+
+
+def _interleave_by_host(jobs: list) -> list:
+    """Order job indexes round-robin across hosts so one busy host doesn't occupy every worker"""
+    by_host = {}
+    for index in range(len(jobs)):
+        host = urlsplit(jobs[index][2]['rss']).netloc.lower()
+        by_host.setdefault(host, []).append(index)
+
+    ordered = []
+    queues = list(by_host.values())
+    while queues:
+        for queue in queues:
+            ordered.append(queue.pop(0))
+        queues = [queue for queue in queues if queue]
+    return ordered
+
+
+def _entry_to_episode(entry: dict, category: str, podcast_id: str, podcast_name: str) -> dict:
+    """Build episode dict from a feedparser or streamed feed entry"""
+    episode = {
+        'podcast_id': podcast_id,
+        'podcast_name': podcast_name,
+        'category': category,
+        'title': entry.get('title', 'No title'),
+        'published': entry.get('published', ''),
+        'description': entry.get('summary', '')[:200],
+        'audio_url': None,
+        'duration': None
+    }
+
+    # Получение audio URL
+    if entry.get('enclosures'):
+        episode['audio_url'] = entry['enclosures'][0].get('href')
+    else:
+        for link in entry.get('links', []):
+            if 'audio' in link.get('type', ''):
+                episode['audio_url'] = link.get('href')
+                break
+
+    # Получение длительности
+    if 'itunes_duration' in entry:
+        episode['duration'] = entry['itunes_duration']
+
+    return episode
+
+
+def fetch_podcast(throttle: HostThrottle, category: str, podcast_id: str, podcast_data: dict) -> list:
+    """Fetch one RSS feed and save its new episodes"""
+    new_episodes = []
+    podcast_name = podcast_data['name']
+    logger.info(f"Fetching podcast: {podcast_name}", extra={
+        "podcast_id": podcast_id,
+        "category": category
+    })
+
+    try:
+        # Условный GET: отправляем валидаторы с прошлого запуска
+        rss_url = podcast_data['rss']
+        cached = DB.get_feed_cache(rss_url) or {}
+        headers = {}
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
+        # Пауза между запросами к одному хосту (важно!)
+        with throttle.slot(rss_url):
+            # Fetch RSS
+            logger.debug(f"Requesting RSS feed: {rss_url}")
+            response = http_client.get(
+                rss_url,
+                policy='feed',
+                headers=headers,
+                stream=True,
+                verify=False,  # В продакшене убрать!
+            )
+
+            if response.status_code == 304:
+                response.close()
+                logger.info(f"Feed not modified since last run: {podcast_name}")
+                return new_episodes
+
+            response.raise_for_status()
+            logger.debug(f"RSS feed response: {response.status_code}")
+
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+
+            # Читаем фид потоком и останавливаемся после самых новых эпизодов
+            stream = FeedStream(response, limit=Config.FEED_MAX_ENTRIES, chunk_size=Config.FEED_STREAM_CHUNK_SIZE)
+            try:
+                entries = list(stream)
+                content_hash = stream.hexdigest()
+                logger.debug(f"Streamed {len(entries)} entries from {podcast_name} "
+                             f"({stream.bytes_read} bytes, truncated: {stream.truncated})")
+            except FeedStreamError as e:
+                logger.info(f"Falling back to feedparser for {podcast_name}: {e}")
+                body = stream.read_all()
+                content_hash = hashlib.sha256(body).hexdigest()
+                entries = None
+            finally:
+                stream.close()
+
+        if content_hash == cached.get('content_hash'):
+            logger.info(f"Feed body unchanged since last run: {podcast_name}")
+            DB.save_feed_cache(rss_url, etag=etag, last_modified=last_modified, content_hash=content_hash)
+            return new_episodes
+
+        if entries is None:
+            # Parse feed
+            feed = feedparser.parse(body)
+
+            # Сюда попадают как раз кривые фиды — берём то, что feedparser смог восстановить
+            if feed.bozo:
+                logger.warning(f"Feed parsing warning for {podcast_name}: {feed.bozo_exception}")
+
+            entries = feed.entries[:Config.FEED_MAX_ENTRIES]
+
+        # Проверка наличия эпизодов
+        if not entries:
+            logger.warning(f"No entries found in feed: {podcast_name}")
+            return new_episodes
+
+        logger.info(f"Found {len(entries)} newest episodes in {podcast_name}")
+
+        # Обработка самых новых эпизодов
+        episodes = []
+        seen = set()
+        for entry in entries:
+            episode = _entry_to_episode(entry, category, podcast_id, podcast_name)
+            if not episode['audio_url'] or episode['duration'] is None:
+                logger.warning(f"Skipping episode without audio_url/duration: {episode['title'][:60]}")
+                continue
+            if episode['title'] in seen:
+                continue
+            seen.add(episode['title'])
+            episodes.append(episode)
+
+        # Одна проверка на дубли и одна транзакция на весь фид
+        existing = DB.existing_episodes([(podcast_id, episode['title']) for episode in episodes])
+        new_episodes = [episode for episode in episodes if (podcast_id, episode['title']) not in existing]
+        DB.save_episodes(new_episodes)
+        for episode in new_episodes:
+            logger.debug(f"New episode saved: {episode['title'][:60]}...")
+
+        logger.info(f"Added {len(new_episodes)} new episodes from {podcast_name}")
+
+        # Валидаторы сохраняем только после успешной обработки фида
+        DB.save_feed_cache(rss_url, etag=etag, last_modified=last_modified, content_hash=content_hash)
+
+    except requests.exceptions.HTTPError as e:
+        logger.error(f"HTTP Error fetching {podcast_name}: {e}", exc_info=True)
+    except requests.exceptions.ConnectionError as e:
+        logger.error(f"Connection Error fetching {podcast_name}: {e}", exc_info=True)
+    except requests.exceptions.Timeout:
+        logger.error(f"Timeout fetching {podcast_name}")
+    except Exception as e:
+        logger.error(f"Unexpected error fetching {podcast_name}: {type(e).__name__}: {e}", exc_info=True)
+
+    return new_episodes
+
+
 @log_execution_time(logger, "fetch new episodes")
 def fetch_new_episodes():
     """Fetch new episodes from RSS feeds"""
     logger.info("Starting to fetch new episodes from RSS feeds")
     feeds = load_podcasts_feeds()
     new_episodes = []
-    session = create_session()
-    
+
+    jobs = []
     for category, podcasts in feeds.items():
         logger.info(f"Processing category: {category}")
-        
         for podcast_id, podcast_data in podcasts.items():
-            podcast_name = podcast_data['name']
-            logger.info(f"Fetching podcast: {podcast_name}", extra={
-                "podcast_id": podcast_id,
-                "category": category
-            })
-            
-            try:
-                # Пауза между запросами (важно!)
-                time.sleep(3)
-                
-                # Fetch RSS
-                logger.debug(f"Requesting RSS feed: {podcast_data['rss']}")
-                response = session.get(
-                    podcast_data['rss'], 
-                    verify=False,  # В продакшене убрать!
-                    timeout=15
-                )
-                response.raise_for_status()
-                logger.debug(f"RSS feed response: {response.status_code}")
-                
-                # Parse feed
-                feed = feedparser.parse(response.content)
-                
-                # Проверка на ошибки парсинга
-                if feed.bozo:
-                    logger.warning(f"Feed parsing warning for {podcast_name}: {feed.bozo_exception}")
-                    continue
-                
-                # Проверка наличия эпизодов
-                if not feed.entries:
-                    logger.warning(f"No entries found in feed: {podcast_name}")
-                    continue
-                
-                logger.info(f"Found {len(feed.entries)} episodes in {podcast_name}")
-                
-                # Обработка первых 10 эпизодов
-                new_count = 0
-                for entry in feed.entries[:10]:
-                    episode = {
-                        'podcast_id': podcast_id,
-                        'podcast_name': podcast_name,
-                        'category': category,
-                        'title': entry.get('title', 'No title'),
-                        'published': entry.get('published', ''),
-                        'description': entry.get('summary', '')[:200],
-                        'audio_url': None,
-                        'duration': None
-                    }
-                    
-                    # Получение audio URL
-                    if hasattr(entry, 'enclosures') and entry.enclosures:
-                        episode['audio_url'] = entry.enclosures[0].get('href')
-                    elif hasattr(entry, 'links'):
-                        for link in entry.links:
-                            if 'audio' in link.get('type', ''):
-                                episode['audio_url'] = link.get('href')
-                                break
-                    
-                    # Получение длительности
-                    if hasattr(entry, 'itunes_duration'):
-                        episode['duration'] = entry.itunes_duration
-                    
-                    if not DB.episode_exist(podcast_id=episode['podcast_id'], podcast_title=episode['title']):
-                        new_episodes.append(episode)
-                        DB.save_episode(podcast_id=podcast_id, podcast_name=podcast_name, podcast_title=episode['title'],
-                                        category=episode['category'], published=False,
-                                        audio_url=episode['audio_url'], duration=episode['duration'])
-                        new_count += 1
-                        logger.debug(f"New episode saved: {entry.title[:60]}...")
-                
-                logger.info(f"Added {new_count} new episodes from {podcast_name}")
-                
-            except requests.exceptions.HTTPError as e:
-                logger.error(f"HTTP Error fetching {podcast_name}: {e}", exc_info=True)
-            except requests.exceptions.ConnectionError as e:
-                logger.error(f"Connection Error fetching {podcast_name}: {e}", exc_info=True)
-            except requests.exceptions.Timeout:
-                logger.error(f"Timeout fetching {podcast_name}")
-            except Exception as e:
-                logger.error(f"Unexpected error fetching {podcast_name}: {type(e).__name__}: {e}", exc_info=True)
-    
+            jobs.append((category, podcast_id, podcast_data))
+
+    workers = max(1, min(Config.FETCH_CONCURRENCY, len(jobs)))
+    logger.info(f"Fetching {len(jobs)} feeds with {workers} workers "
+                f"(per host: {Config.FETCH_PER_HOST_CONCURRENCY}, delay: {Config.FETCH_HOST_DELAY}s)")
+    throttle = HostThrottle(per_host_limit=Config.FETCH_PER_HOST_CONCURRENCY, delay=Config.FETCH_HOST_DELAY)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rss-fetch") as executor:
+        futures = {
+            index: executor.submit(fetch_podcast, throttle, *jobs[index])
+            for index in _interleave_by_host(jobs)
+        }
+        # Результат собираем в исходном порядке фидов
+        for index in range(len(jobs)):
+            new_episodes.extend(futures[index].result())
+
     logger.info(f"Total new episodes fetched: {len(new_episodes)}")
-    return new_episodes
\ No newline at end of file
+    return new_episodes
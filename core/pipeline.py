@@ -0,0 +1,102 @@
+# pipeline.py
+"""
+Staged processing pipeline.
+
+Every stage has its own pool of worker threads and reads from a bounded
+queue fed by the previous stage:
+
+    items ──► [download ×N] ──► queue ──► [transcribe ×M] ──► queue ──► [summarize ×K] ──► done
+
+When a queue is full the upstream workers wait, so a fast downloader can't
+pile up more audio than transcription can handle. A stage handler returns
+True to pass the item on and False to drop it (it reports the failure
+itself); unexpected exceptions are logged and also drop the item.
+"""
+import queue
+import threading
+from typing import Callable, Iterable, Optional
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+_DONE = object()
+
+
+class Stage:
+    def __init__(self, name: str, handler: Callable[[dict], bool], workers: int = 1):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+
+
+class Pipeline:
+    def __init__(self, stages: list, queue_size: int = 2, on_finish: Optional[Callable[[dict, bool], None]] = None):
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        # Вызывается для каждого элемента: после последней стадии или после отказа
+        self.on_finish = on_finish
+
+    def _finish(self, item: dict, ok: bool) -> None:
+        if self.on_finish:
+            try:
+                self.on_finish(item, ok)
+            except Exception as e:
+                logger.error(f"Pipeline finish hook failed: {type(e).__name__}: {e}", exc_info=True)
+
+    def run(self, items: Iterable[dict]) -> list:
+        """Push items through all stages, returns the items that completed every stage"""
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        completed = []
+        completed_lock = threading.Lock()
+        threads = []
+
+        for index, stage in enumerate(self.stages):
+            inbox = queues[index]
+            outbox = queues[index + 1] if index + 1 < len(self.stages) else None
+            next_workers = self.stages[index + 1].workers if outbox is not None else 0
+            remaining = [stage.workers]
+            remaining_lock = threading.Lock()
+
+            def work(stage=stage, inbox=inbox, outbox=outbox, next_workers=next_workers,
+                     remaining=remaining, remaining_lock=remaining_lock):
+                while True:
+                    item = inbox.get()
+                    if item is _DONE:
+                        break
+                    try:
+                        ok = stage.handler(item)
+                    except Exception as e:
+                        logger.error(f"✗ Stage '{stage.name}' failed: {type(e).__name__}: {e}", exc_info=True)
+                        ok = False
+
+                    if not ok:
+                        self._finish(item, False)
+                    elif outbox is not None:
+                        outbox.put(item)  # ждёт, если следующая стадия не успевает
+                    else:
+                        with completed_lock:
+                            completed.append(item)
+                        self._finish(item, True)
+
+                # Последний завершившийся воркер закрывает следующую стадию
+                with remaining_lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last and outbox is not None:
+                    for _ in range(next_workers):
+                        outbox.put(_DONE)
+
+            for number in range(stage.workers):
+                thread = threading.Thread(target=work, name=f"pipeline-{stage.name}-{number}", daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        for item in items:
+            queues[0].put(item)
+        for _ in range(self.stages[0].workers):
+            queues[0].put(_DONE)
+
+        for thread in threads:
+            thread.join()
+        return completed
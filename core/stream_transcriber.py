@@ -0,0 +1,261 @@
+# stream_transcriber.py
+"""
+Transcribe an episode while it is still downloading.
+
+    HTTP stream ──► ffmpeg (stdin → 16 kHz s16le PCM) ──► bounded PCM queue ──► Whisper chunks
+
+A feeder thread pushes the HTTP body into ffmpeg, a reader thread drains
+decoded PCM into a bounded queue, and the calling thread cuts the audio
+into silence-aligned chunks and transcribes them as soon as they are
+complete. When the queue is full ffmpeg and the download simply wait, so
+memory stays bounded and nothing is written to disk. If the server drops
+the connection meanwhile, the feeder reconnects with Range/If-Range from
+the last byte and keeps feeding the same ffmpeg process.
+"""
+import hashlib
+import queue
+import subprocess
+import threading
+from collections import deque
+from typing import Optional
+
+import numpy as np
+import requests
+
+from core.ai_processor import transcription_settings
+from core.audio_processor import _resume_validator
+from core.chunked_transcriber import (
+    SAMPLE_RATE, _get_pool, _transcribe_chunk, quietest_point, shift_result, stitch_results,
+)
+from core.config import Config
+from core.model_registry import model_registry
+from core.transcript_cache import transcript_cache
+from core.vad import trim_non_speech
+from utils.http_client import http_client
+from utils.logger import get_logger
+from utils.proxy_manager import proxy_manager
+
+logger = get_logger(__name__)
+
+PCM_BLOCK_BYTES = SAMPLE_RATE * 2  # 1 секунда s16le mono
+
+
+class StreamTranscriptionError(Exception):
+    pass
+
+
+class _AudioStream:
+    """Download → ffmpeg → PCM queue plumbing"""
+
+    def __init__(self, audio_url: str, proxies: Optional[dict]):
+        self.audio_url = audio_url
+        self.proxies = proxies
+        self.error: Optional[Exception] = None
+        self.bytes_downloaded = 0
+        self.total_size = 0
+        self.validator: Optional[str] = None
+        self.digest = hashlib.sha256()
+        self.blocks = queue.Queue(maxsize=max(1, int(Config.STREAM_BUFFER_SECONDS)))
+        self.process = subprocess.Popen(
+            ['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', 'pipe:0',
+             '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), 'pipe:1'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        )
+        self._stopped = threading.Event()
+        self._feeder = threading.Thread(target=self._feed, name="stream-feeder", daemon=True)
+        self._reader = threading.Thread(target=self._read, name="stream-reader", daemon=True)
+        self._feeder.start()
+        self._reader.start()
+
+    def _open(self, headers: dict):
+        response = http_client.get(self.audio_url, policy='download', stream=True, headers=headers, proxies=self.proxies)
+        response.raise_for_status()
+        if not self.bytes_downloaded:
+            self.validator = _resume_validator({
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            })
+            self.total_size = int(response.headers.get('content-length', 0))
+            return response
+
+        # Продолжение: склеивать можно только тот же файл с нужного байта
+        content_range = response.headers.get('Content-Range', '')
+        if response.status_code != 206 or not content_range.startswith(f'bytes {self.bytes_downloaded}-'):
+            response.close()
+            raise StreamTranscriptionError("Server ignored range request or file changed, can't resume stream")
+        return response
+
+    def _feed(self) -> None:
+        attempt = 0
+        try:
+            while True:
+                headers = {}
+                if self.bytes_downloaded:
+                    headers['Range'] = f'bytes={self.bytes_downloaded}-'
+                    headers['If-Range'] = self.validator
+                try:
+                    with self._open(headers) as response:
+                        for chunk in response.iter_content(chunk_size=Config.DOWNLOAD_CHUNK_SIZE):
+                            if self._stopped.is_set():
+                                return
+                            if chunk:
+                                self.digest.update(chunk)
+                                self.bytes_downloaded += len(chunk)
+                                self.process.stdin.write(chunk)
+                    if self.total_size and self.bytes_downloaded < self.total_size:
+                        raise requests.exceptions.ConnectionError(
+                            f"Connection closed at {self.bytes_downloaded} of {self.total_size} bytes")
+                    return
+                except requests.exceptions.RequestException as e:
+                    # CDN мог закрыть соединение, пока мы ждали Whisper — докачиваем с того же байта
+                    attempt += 1
+                    if not self.bytes_downloaded or not self.validator or attempt > Config.STREAM_RECONNECTS:
+                        raise
+                    logger.warning(f"Stream interrupted at {self.bytes_downloaded / (1024*1024):.2f} MB "
+                                   f"({type(e).__name__}), reconnecting ({attempt}/{Config.STREAM_RECONNECTS})")
+                    if self._stopped.wait(min(2 ** attempt, 30)):
+                        return
+        except (BrokenPipeError, ValueError):
+            # ffmpeg завершился раньше — ошибку покажет reader / код возврата
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+
+    def _read(self) -> None:
+        try:
+            while True:
+                data = self.process.stdout.read(PCM_BLOCK_BYTES)
+                if not data:
+                    break
+                block = np.frombuffer(data[:len(data) // 2 * 2], np.int16).astype(np.float32) / 32768.0
+                while not self._stopped.is_set():
+                    try:
+                        self.blocks.put(block, timeout=1)
+                        break
+                    except queue.Full:
+                        continue
+        finally:
+            self.blocks.put(None)
+
+    def __iter__(self):
+        while True:
+            block = self.blocks.get()
+            if block is None:
+                return
+            yield block
+
+    def close(self) -> None:
+        self._stopped.set()
+        # Освобождаем reader, если он ждёт места в очереди
+        while not self.blocks.empty():
+            try:
+                self.blocks.get_nowait()
+            except queue.Empty:
+                break
+        self.process.kill()
+        self.process.wait()
+        self._feeder.join(timeout=5)
+        self._reader.join(timeout=5)
+
+
+def _prepare_chunk(audio: np.ndarray) -> tuple:
+    if Config.VAD_ENABLED:
+        return trim_non_speech(audio)
+    return audio, None
+
+
+def _finish_chunk(result: dict, speech_map, offset: float) -> dict:
+    if speech_map:
+        speech_map.remap_result(result)
+    return shift_result(result, offset)
+
+
+def stream_transcribe(audio_url: str) -> tuple:
+    """Download and transcribe an episode at the same time, returns (Whisper result, transcript cache key)"""
+    options = transcription_settings()
+    options.pop('model')
+    options.pop('vad')
+
+    proxies = proxy_manager.get_proxy() if Config.USE_PROXY else None
+    chunk = int(Config.STREAM_CHUNK_SECONDS * SAMPLE_RATE)
+    overlap = int(Config.TRANSCRIBE_CHUNK_OVERLAP * SAMPLE_RATE)
+    search = int(min(Config.TRANSCRIBE_SPLIT_SEARCH, Config.STREAM_CHUNK_SECONDS / 4) * SAMPLE_RATE)
+    workers = Config.TRANSCRIBE_WORKERS
+    pool = _get_pool(workers) if workers > 1 else None
+
+    # buffer — аудио начиная с абсолютного сэмпла buffer_start; слова чанка берём с keep_from
+    buffer = np.zeros(0, dtype=np.float32)
+    buffer_start = 0
+    keep_from = float('-inf')
+    pending = deque()  # (future или результат, speech_map, offset, keep_from, keep_to)
+    parts = []
+
+    def submit(audio: np.ndarray, offset: int, keep_to: float) -> None:
+        audio, speech_map = _prepare_chunk(audio)
+        if pool:
+            job = pool.submit(_transcribe_chunk, audio, 0.0, options)
+        else:
+            job = model_registry.transcribe(audio, **options)
+        pending.append((job, speech_map, offset / SAMPLE_RATE, keep_from, keep_to))
+        logger.info(f"Stream chunk queued at {offset / SAMPLE_RATE / 60:.1f} min "
+                    f"({len(audio) / SAMPLE_RATE:.0f}s of audio)")
+
+    def collect(limit: int) -> None:
+        while len(pending) > limit:
+            job, speech_map, offset, part_keep_from, part_keep_to = pending.popleft()
+            result = job.result() if pool else job
+            parts.append((_finish_chunk(result, speech_map, offset), part_keep_from, part_keep_to))
+
+    stream = _AudioStream(audio_url, proxies)
+    try:
+        blocks = []
+        buffered = 0
+        for block in stream:
+            blocks.append(block)
+            buffered += len(block)
+            if buffered < chunk + search:
+                continue
+
+            buffer = np.concatenate([buffer, *blocks])
+            blocks, buffered = [], len(buffer)
+            # Режем по паузе рядом с границей чанка, оставляя перекрытие для контекста
+            split = quietest_point(buffer, chunk - search, chunk + search)
+            submit(buffer[:split + overlap], buffer_start, (buffer_start + split) / SAMPLE_RATE)
+            keep_from = (buffer_start + split) / SAMPLE_RATE
+            buffer = buffer[max(0, split - overlap):]
+            buffer_start += max(0, split - overlap)
+            buffered = len(buffer)
+            # Ограничиваем число чанков в работе
+            collect(limit=max(1, workers) * 2 if pool else 0)
+
+        if stream.error:
+            if proxies:
+                proxy_manager.mark_proxy_as_failed(proxies['http'])
+            raise StreamTranscriptionError(f"Download failed after {stream.bytes_downloaded} bytes: {stream.error}")
+        return_code = stream.process.wait()
+        if return_code != 0:
+            raise StreamTranscriptionError(f"ffmpeg exited with code {return_code}")
+
+        if proxies:
+            proxy_manager.record_success(proxies['http'])
+
+        buffer = np.concatenate([buffer, *blocks])
+        if len(buffer):
+            submit(buffer, buffer_start, float('inf'))
+        collect(limit=0)
+    finally:
+        stream.close()
+
+    result = stitch_results(parts)
+    logger.info(f"Streamed {stream.bytes_downloaded / (1024*1024):.2f} MB, "
+                f"transcribed {len(parts)} chunks, {len(result['text'])} chars")
+
+    # Тот же ключ, что у скачанного файла — повторный запуск возьмёт результат из кэша
+    cache_key = transcript_cache.key_for_hash(stream.digest.hexdigest(), transcription_settings())
+    transcript_cache.put(cache_key, result)
+    return result, cache_key
@@ -0,0 +1,54 @@
+# summary_cache.py
+"""
+Persistent cache of LLM summaries.
+
+The key covers everything that determines the answer: the transcript
+text, the prompt template version, the providers' models and request
+parameters and the chunking settings. A rerun after a failure further
+down the pipeline gets the summary back without another LLM round trip.
+Entries expire after their TTL, and the least recently used ones are
+dropped once the table exceeds its byte budget.
+"""
+import hashlib
+import json
+import time
+from typing import Optional
+
+from core.config import Config
+from data.database import DB
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class SummaryCache:
+    def __init__(self, ttl: float, max_bytes: int):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key_for(transcript: str, settings: dict) -> str:
+        transcript_hash = hashlib.sha256(transcript.encode()).hexdigest()
+        payload = json.dumps(settings, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(f"{transcript_hash}:{payload}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        summary = DB.get_summary_cache(key, min_created_at=time.time() - self.ttl)
+        if summary:
+            logger.info(f"Summary cache hit: {key[:12]}")
+        return summary
+
+    def put(self, key: str, summary: str) -> None:
+        DB.save_summary_cache(key, summary)
+        logger.info(f"Summary cached: {key[:12]} ({len(summary)} chars)")
+        self.evict()
+
+    def evict(self) -> int:
+        removed = DB.evict_summary_cache(min_created_at=time.time() - self.ttl, max_bytes=self.max_bytes)
+        if removed:
+            logger.info(f"Evicted {removed} summary cache entries")
+        return removed
+
+
+# Глобальный кэш саммари
+summary_cache = SummaryCache(Config.SUMMARY_CACHE_TTL, Config.SUMMARY_CACHE_MAX_BYTES)
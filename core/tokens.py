@@ -0,0 +1,67 @@
+# tokens.py
+"""
+Token counting and token-budgeted splitting for LLM prompts.
+
+Uses tiktoken; if the encoding can't be loaded (it is downloaded on first
+use) a rough characters-per-token estimate is used instead.
+"""
+import re
+from functools import lru_cache
+
+import tiktoken
+
+from core.config import Config
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+CHARS_PER_TOKEN = 4  # грубая оценка, если словарь tiktoken недоступен
+SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        return tiktoken.get_encoding(Config.TOKENIZER_ENCODING)
+    except Exception as e:
+        logger.warning(f"tiktoken encoding {Config.TOKENIZER_ENCODING} unavailable, estimating tokens: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _hard_split(text: str, max_tokens: int) -> list:
+    """Cut text that has no sentence boundaries into max_tokens pieces"""
+    encoding = _encoding()
+    if encoding is None:
+        step = max_tokens * CHARS_PER_TOKEN
+        return [text[i:i + step] for i in range(0, len(text), step)]
+    tokens = encoding.encode(text, disallowed_special=())
+    return [encoding.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+
+
+def split_by_tokens(text: str, max_tokens: int) -> list:
+    """Split text into chunks of at most max_tokens, breaking between sentences where possible"""
+    chunks = []
+    current, current_tokens = [], 0
+    for sentence in SENTENCE_END.split(text.strip()):
+        size = count_tokens(sentence) + 1
+        if size > max_tokens:
+            pieces = _hard_split(sentence, max_tokens)
+        else:
+            pieces = [sentence]
+        for piece in pieces:
+            size = count_tokens(piece) + 1 if len(pieces) > 1 else size
+            if current and current_tokens + size > max_tokens:
+                chunks.append(" ".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += size
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
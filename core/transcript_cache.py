@@ -0,0 +1,114 @@
+# transcript_cache.py
+"""
+Content-addressed store of Whisper results.
+
+The key is a hash of the audio bytes plus the model name and transcription
+options, so retries and the same audio published under two feeds never
+run Whisper twice. Results are kept as gzip-compressed JSON, the least
+recently used entries are evicted once the store exceeds its byte budget.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+from core.config import Config
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def file_hash(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _to_json(value):
+    # numpy-скаляры в результате Whisper
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class TranscriptCache:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def key_for(self, audio_path: str, settings: dict) -> str:
+        """Cache key for an audio file transcribed with the given model/options"""
+        return self.key_for_hash(file_hash(audio_path), settings)
+
+    def key_for_hash(self, audio_hash: str, settings: dict) -> str:
+        """Cache key for audio with a known SHA-256 (e.g. hashed while streaming)"""
+        payload = json.dumps(settings, sort_keys=True, default=str)
+        return hashlib.sha256(f"{audio_hash}:{payload}".encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json.gz"
+
+    def get(self, key: str) -> Optional[dict]:
+        path = self._path(key)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                result = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Corrupted transcript cache entry {key[:12]}: {e}")
+            path.unlink(missing_ok=True)
+            return None
+
+        # mtime = время последнего обращения (для LRU)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        logger.info(f"Transcript cache hit: {key[:12]}")
+        return result
+
+    def put(self, key: str, result: dict) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, separators=(',', ':'), default=_to_json)
+        os.replace(tmp_path, path)
+        logger.info(f"Transcript cached: {key[:12]} ({path.stat().st_size / 1024:.1f} KB)")
+        self.evict()
+
+    def evict(self) -> int:
+        """Remove least recently used entries until the store fits max_bytes"""
+        with self._lock:
+            entries = []
+            for path in self.directory.glob('*.json.gz'):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+                removed += 1
+
+        if removed:
+            logger.info(f"Evicted {removed} transcript cache entries")
+        return removed
+
+
+# Глобальный кэш транскриптов
+transcript_cache = TranscriptCache(Config.TRANSCRIPT_CACHE_DIR, Config.TRANSCRIPT_CACHE_MAX_BYTES)
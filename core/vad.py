@@ -0,0 +1,124 @@
+# vad.py
+"""
+Energy-based voice activity detection for 16 kHz mono audio.
+
+Long silences, intros and music beds are cut out before Whisper sees the
+audio. `SpeechMap` remembers where every kept span came from, so segment
+and word timestamps of the trimmed transcription can be mapped back to
+the original episode timeline.
+"""
+from bisect import bisect_right
+
+import numpy as np
+
+from core.config import Config
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+SAMPLE_RATE = 16000
+
+
+def frame_energy_db(audio: np.ndarray, frame: int) -> np.ndarray:
+    """Log energy of consecutive non-overlapping frames"""
+    frames = len(audio) // frame
+    blocks = audio[:frames * frame].reshape(frames, frame)
+    # einsum не создаёт временный массив квадратов размером с всё аудио
+    power = np.einsum('ij,ij->i', blocks, blocks) / frame
+    return 10 * np.log10(power + 1e-10)
+
+
+def music_mask(energy_db: np.ndarray, frames_per_window: int, min_low_energy_ratio: float) -> np.ndarray:
+    """
+    Flag frames inside ~1 s windows that look like music.
+
+    Speech has syllable gaps, so a good share of its frames sit well below the
+    window's mean energy; music beds are much steadier.
+    """
+    windows = len(energy_db) // frames_per_window
+    mask = np.zeros(len(energy_db), dtype=bool)
+    if windows == 0:
+        return mask
+    power = np.power(10, energy_db[:windows * frames_per_window] / 10).reshape(windows, frames_per_window)
+    low_ratio = (power < 0.5 * power.mean(axis=1, keepdims=True)).mean(axis=1)
+    mask[:windows * frames_per_window] = np.repeat(low_ratio < min_low_energy_ratio, frames_per_window)
+    return mask
+
+
+def detect_speech(audio: np.ndarray) -> list:
+    """Return speech spans as (start, end) sample indexes"""
+    frame = SAMPLE_RATE * Config.VAD_FRAME_MS // 1000
+    energy_db = frame_energy_db(audio, frame)
+    if len(energy_db) == 0:
+        return []
+
+    # Порог относительно шумового фона записи
+    noise_floor = np.percentile(energy_db, 10)
+    threshold = max(noise_floor + Config.VAD_THRESHOLD_DB, Config.VAD_MIN_ENERGY_DB)
+    speech = energy_db > threshold
+    if Config.VAD_MUSIC_FILTER:
+        speech &= ~music_mask(energy_db, 1000 // Config.VAD_FRAME_MS, Config.VAD_MUSIC_LOW_ENERGY_RATIO)
+
+    # Границы отрезков речи (переходы 0→1 и 1→0)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], speech.astype(np.int8), [0]))))
+    starts, ends = edges[::2] * frame, edges[1::2] * frame
+
+    pad = SAMPLE_RATE * Config.VAD_PAD_MS // 1000
+    min_silence = int(SAMPLE_RATE * Config.VAD_MIN_SILENCE)
+    min_speech = int(SAMPLE_RATE * Config.VAD_MIN_SPEECH)
+
+    spans = []
+    for start, end in zip(starts, ends):
+        start, end = max(0, int(start) - pad), min(len(audio), int(end) + pad)
+        # Короткие паузы не вырезаем
+        if spans and start - spans[-1][1] < min_silence:
+            spans[-1][1] = end
+        else:
+            spans.append([start, end])
+    # Одиночные щелчки и всплески после склейки отбрасываем
+    return [tuple(span) for span in spans if span[1] - span[0] - 2 * pad >= min_speech]
+
+
+class SpeechMap:
+    """Maps timestamps of the trimmed audio back to the original audio"""
+
+    def __init__(self, spans: list):
+        self.spans = spans
+        self._trimmed_starts = []
+        self._original_starts = []
+        position = 0
+        for start, end in spans:
+            self._trimmed_starts.append(position / SAMPLE_RATE)
+            self._original_starts.append(start / SAMPLE_RATE)
+            position += end - start
+
+    def to_original(self, seconds: float, is_end: bool = False) -> float:
+        if not self.spans:
+            return seconds
+        # Конец отрезка, попавший ровно на стык, относим к предыдущему куску
+        index = bisect_right(self._trimmed_starts, seconds - (1e-6 if is_end else 0)) - 1
+        index = max(index, 0)
+        return round(self._original_starts[index] + seconds - self._trimmed_starts[index], 3)
+
+    def remap_result(self, result: dict) -> dict:
+        """Rewrite segment and word timestamps to the original timeline (in place)"""
+        for segment in result.get('segments', []):
+            segment['start'] = self.to_original(segment['start'])
+            segment['end'] = self.to_original(segment['end'], is_end=True)
+            for word in segment.get('words') or []:
+                word['start'] = self.to_original(word['start'])
+                word['end'] = self.to_original(word['end'], is_end=True)
+        return result
+
+
+def trim_non_speech(audio: np.ndarray) -> tuple:
+    """Cut non-speech regions, returns (speech audio, SpeechMap)"""
+    spans = detect_speech(audio)
+    if not spans:
+        logger.warning("VAD found no speech, transcribing the whole audio")
+        return audio, SpeechMap([(0, len(audio))])
+
+    trimmed = np.concatenate([audio[start:end] for start, end in spans])
+    logger.info(f"VAD kept {len(trimmed) / SAMPLE_RATE / 60:.1f} of {len(audio) / SAMPLE_RATE / 60:.1f} min "
+                f"in {len(spans)} speech spans")
+    return trimmed, SpeechMap(spans)
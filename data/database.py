@@ -1,41 +1,199 @@
+import random
 import sqlite3
+import threading
+import time
+from core.config import Config
 
 DB_NAME = "podcasts.db"
+BATCH_SIZE = 400
+
+# Миграции схемы: индекс в списке + 1 = номер версии в PRAGMA user_version.
+# Новые миграции добавляются только в конец списка.
+MIGRATIONS = [
+    # 1: базовая схема
+    [
+        """
+        CREATE TABLE IF NOT EXISTS episodes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            podcast_id TEXT NOT NULL,
+            podcast_name TEXT NOT NULL,
+            podcast_title TEXT NOT NULL,
+            category TEXT NOT NULL,
+            published BOOL DEFAULT FALSE,
+            audio_url TEXT NOT NULL,
+            duration TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS feed_cache (
+            feed_url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            content_hash TEXT,
+            checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ],
+    # 2: уникальность эпизода и индекс неопубликованных
+    [
+        # Перед уникальным индексом убираем дубли (оставляем опубликованный / самый старый)
+        """
+        DELETE FROM episodes WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY podcast_id, podcast_title ORDER BY published DESC, id
+                ) AS row_number
+                FROM episodes
+            ) WHERE row_number > 1
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_episodes_podcast_title ON episodes (podcast_id, podcast_title)",
+        "CREATE INDEX IF NOT EXISTS idx_episodes_unpublished ON episodes (id) WHERE published = 0",
+    ],
+    # 3: индекс кэша скачанного аудио
+    [
+        """
+        CREATE TABLE IF NOT EXISTS audio_cache (
+            cache_key TEXT PRIMARY KEY,
+            audio_url TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER DEFAULT 0,
+            state TEXT NOT NULL,
+            last_access REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_audio_cache_last_access ON audio_cache (last_access)",
+    ],
+    # 4: состояние пула прокси (переживает перезапуск)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS proxy_stats (
+            proxy TEXT PRIMARY KEY,
+            latency REAL,
+            success_rate REAL NOT NULL DEFAULT 1,
+            failures INTEGER NOT NULL DEFAULT 0,
+            trips INTEGER NOT NULL DEFAULT 0,
+            open_until REAL NOT NULL DEFAULT 0,
+            updated_at REAL NOT NULL
+        )
+        """,
+    ],
+    # 5: состояние обработки эпизодов (стадия, артефакты, повторы)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS episode_jobs (
+            episode_id INTEGER PRIMARY KEY REFERENCES episodes (id),
+            stage TEXT,
+            audio_path TEXT,
+            transcript_key TEXT,
+            summary TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            next_retry_at REAL NOT NULL DEFAULT 0,
+            updated_at REAL NOT NULL
+        )
+        """,
+    ],
+    # 6: кэш саммари (ключ — хэш транскрипта, версия промпта и параметры моделей)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS summary_cache (
+            cache_key TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_summary_cache_last_access ON summary_cache (last_access)",
+    ],
+]
+
+NOT_BACKING_OFF = "NOT EXISTS (SELECT 1 FROM episode_jobs WHERE episode_id = episodes.id AND next_retry_at > ?)"
+
+# Стадии обработки эпизода по порядку
+JOB_STAGES = ('downloaded', 'transcribed', 'summarized', 'published')
 
 class Database:
     def __init__(self, db_path: str):
         self.db_path = db_path
+        # Одно соединение на поток: без connect() на каждый вызов и без общих курсоров между потоками
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: list[tuple[threading.Thread, sqlite3.Connection]] = []
+
+    def _get_connection(self) -> sqlite3.Connection:
+        con = getattr(self._local, 'connection', None)
+        if con is not None:
+            return con
 
-    def _get_connection(self):
-        con = sqlite3.connect(self.db_path)
+        con = sqlite3.connect(
+            self.db_path,
+            timeout=Config.DB_BUSY_TIMEOUT_MS / 1000,
+            cached_statements=Config.DB_STATEMENT_CACHE_SIZE,
+            check_same_thread=False,  # закрываем из close_all(); используется только своим потоком
+        )
         con.row_factory = sqlite3.Row  # ← Добавляем это
+        con.execute("PRAGMA journal_mode = WAL")
+        con.execute(f"PRAGMA synchronous = {Config.DB_SYNCHRONOUS}")
+        con.execute(f"PRAGMA busy_timeout = {Config.DB_BUSY_TIMEOUT_MS}")
+        self._local.connection = con
+
+        with self._lock:
+            # Закрываем соединения завершившихся потоков (пулы потоков пересоздаются на каждый запуск)
+            alive = []
+            for thread, connection in self._connections:
+                if thread.is_alive():
+                    alive.append((thread, connection))
+                else:
+                    connection.close()
+            alive.append((threading.current_thread(), con))
+            self._connections = alive
         return con
 
+    def close(self) -> None:
+        """Close the calling thread's connection."""
+        con = getattr(self._local, 'connection', None)
+        if con is None:
+            return
+        self._local.connection = None
+        with self._lock:
+            self._connections = [(thread, connection) for thread, connection in self._connections if connection is not con]
+        con.close()
+
+    def close_all(self) -> None:
+        """Close every open connection (call on shutdown)."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for _, connection in connections:
+            connection.close()
+        self._local = threading.local()
+
     def init_db(self):
+        """Apply pending schema migrations (version is kept in PRAGMA user_version)."""
         con = self._get_connection()
         cur = con.cursor()
+        version = cur.execute("PRAGMA user_version").fetchone()[0]
+
+        for number, statements in enumerate(MIGRATIONS, start=1):
+            if number <= version:
+                continue
+            cur.execute("BEGIN")
+            try:
+                for statement in statements:
+                    cur.execute(statement)
+                cur.execute(f"PRAGMA user_version = {number}")
+                con.commit()
+            except Exception:
+                con.rollback()
+                raise
 
-        cur.execute("""
-                    CREATE TABLE IF NOT EXISTS episodes (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        podcast_id TEXT NOT NULL,
-                        podcast_name TEXT NOT NULL,
-                        podcast_title TEXT NOT NULL,
-                        category TEXT NOT NULL,
-                        published BOOL DEFAULT FALSE,
-                        audio_url TEXT NOT NULL,
-                        duration TEXT NOT NULL
-                    )
-        """)
-        con.commit()
-        con.close()
 
     def get_episode(self, podcast_id: str, podcast_title: str) -> list:
         con = self._get_connection()
         cur = con.cursor()
         res = cur.execute("SELECT * FROM episodes WHERE podcast_id = ? AND podcast_title = ?", (podcast_id, podcast_title))
         result = [dict(row) for row in res.fetchall()]  # ← Конвертируем в dict
-        con.close()
         return result
     
     def episode_exist(self, podcast_id: str, podcast_title: str) -> bool:
@@ -44,30 +202,246 @@ class Database:
     
     def save_episode(self, podcast_id: str, podcast_name: str, podcast_title: str, category: str, published: str, audio_url: str, duration: str) -> None:
         con = self._get_connection()
-        cur = con.cursor()
-        cur.execute("""
-                    INSERT INTO episodes (podcast_id, podcast_name, podcast_title, category, published, audio_url, duration) VALUES (?, ?, ?, ?, ?, ?, ?)
+        with con:
+            con.execute("""
+                    INSERT OR IGNORE INTO episodes (podcast_id, podcast_name, podcast_title, category, published, audio_url, duration) VALUES (?, ?, ?, ?, ?, ?, ?)
                     """, (podcast_id, podcast_name, podcast_title, category, published, audio_url, duration))
-        con.commit()
-        con.close()
 
-    def mark_as_used(self, id: int) -> None:
+    def existing_episodes(self, pairs: list[tuple[str, str]]) -> set[tuple[str, str]]:
+        """Return the (podcast_id, podcast_title) pairs from the batch that are already saved."""
+        existing = set()
+        if not pairs:
+            return existing
+
         con = self._get_connection()
         cur = con.cursor()
-        cur.execute("""
+        # Разбиваем на пачки, чтобы не упереться в лимит параметров SQLite
+        for i in range(0, len(pairs), BATCH_SIZE):
+            batch = pairs[i:i + BATCH_SIZE]
+            placeholders = ", ".join(["(?, ?)"] * len(batch))
+            params = [value for pair in batch for value in pair]
+            # JOIN с CTE, а не (a, b) IN (VALUES ...): так SQLite ищет каждую пару по индексу, а не сканирует его
+            res = cur.execute(f"""
+                    WITH batch(pid, title) AS (VALUES {placeholders})
+                    SELECT podcast_id, podcast_title FROM batch
+                    JOIN episodes ON podcast_id = pid AND podcast_title = title
+                    """, params)
+            existing.update((row['podcast_id'], row['podcast_title']) for row in res.fetchall())
+        return existing
+
+    def save_episodes(self, episodes: list[dict]) -> None:
+        """Insert a batch of episodes in a single transaction."""
+        if not episodes:
+            return
+
+        con = self._get_connection()
+        with con:
+            con.executemany("""
+                    INSERT OR IGNORE INTO episodes (podcast_id, podcast_name, podcast_title, category, published, audio_url, duration) VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """, [(episode['podcast_id'], episode['podcast_name'], episode['title'], episode['category'],
+                           False, episode['audio_url'], episode['duration']) for episode in episodes])
+
+    def get_feed_cache(self, feed_url: str) -> dict | None:
+        """Get stored HTTP validators and body hash for a feed."""
+        con = self._get_connection()
+        cur = con.cursor()
+        res = cur.execute("SELECT * FROM feed_cache WHERE feed_url = ?", (feed_url,))
+        row = res.fetchone()
+        return dict(row) if row else None
+
+    def save_feed_cache(self, feed_url: str, etag: str | None, last_modified: str | None, content_hash: str | None) -> None:
+        """Store HTTP validators and body hash of the last processed feed response."""
+        con = self._get_connection()
+        with con:
+            con.execute("""
+                    INSERT INTO feed_cache (feed_url, etag, last_modified, content_hash, checked_at)
+                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(feed_url) DO UPDATE SET
+                        etag = excluded.etag,
+                        last_modified = excluded.last_modified,
+                        content_hash = excluded.content_hash,
+                        checked_at = excluded.checked_at
+                    """, (feed_url, etag, last_modified, content_hash))
+
+    def get_audio_cache(self, cache_key: str) -> dict | None:
+        con = self._get_connection()
+        row = con.execute("SELECT * FROM audio_cache WHERE cache_key = ?", (cache_key,)).fetchone()
+        return dict(row) if row else None
+
+    def save_audio_cache(self, cache_key: str, audio_url: str, path: str, size: int, state: str) -> None:
+        con = self._get_connection()
+        with con:
+            con.execute("""
+                    INSERT INTO audio_cache (cache_key, audio_url, path, size, state, last_access)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(cache_key) DO UPDATE SET
+                        path = excluded.path,
+                        size = excluded.size,
+                        state = excluded.state,
+                        last_access = excluded.last_access
+                    """, (cache_key, audio_url, path, size, state, time.time()))
+
+    def touch_audio_cache(self, cache_key: str) -> None:
+        con = self._get_connection()
+        with con:
+            con.execute("UPDATE audio_cache SET last_access = ? WHERE cache_key = ?", (time.time(), cache_key))
+
+    def delete_audio_cache(self, cache_key: str) -> None:
+        con = self._get_connection()
+        with con:
+            con.execute("DELETE FROM audio_cache WHERE cache_key = ?", (cache_key,))
+
+    def list_audio_cache(self) -> list[dict]:
+        """All cached audio entries, least recently used first."""
+        con = self._get_connection()
+        res = con.execute("SELECT * FROM audio_cache ORDER BY last_access")
+        return [dict(row) for row in res.fetchall()]
+
+    def get_summary_cache(self, cache_key: str, min_created_at: float) -> str | None:
+        """Cached summary created after min_created_at (marks it as recently used)."""
+        con = self._get_connection()
+        with con:
+            row = con.execute("""
+                    UPDATE summary_cache SET last_access = ?
+                    WHERE cache_key = ? AND created_at >= ?
+                    RETURNING summary
+                    """, (time.time(), cache_key, min_created_at)).fetchone()
+        return row['summary'] if row else None
+
+    def save_summary_cache(self, cache_key: str, summary: str) -> None:
+        con = self._get_connection()
+        now = time.time()
+        with con:
+            con.execute("""
+                    INSERT OR REPLACE INTO summary_cache (cache_key, summary, size, created_at, last_access)
+                    VALUES (?, ?, ?, ?, ?)
+                    """, (cache_key, summary, len(summary.encode()), now, now))
+
+    def evict_summary_cache(self, min_created_at: float, max_bytes: int) -> int:
+        """Delete expired summaries, then least recently used ones beyond max_bytes."""
+        con = self._get_connection()
+        with con:
+            expired = con.execute("DELETE FROM summary_cache WHERE created_at < ?", (min_created_at,)).rowcount
+            # Оставляем самые свежие по обращению, пока суммарный размер в пределах лимита
+            evicted = con.execute("""
+                    DELETE FROM summary_cache WHERE cache_key IN (
+                        SELECT cache_key FROM (
+                            SELECT cache_key, SUM(size) OVER (ORDER BY last_access DESC, cache_key) AS kept
+                            FROM summary_cache
+                        ) WHERE kept > ?
+                    )
+                    """, (max_bytes,)).rowcount
+        return expired + evicted
+
+    def load_proxy_stats(self) -> list[dict]:
+        con = self._get_connection()
+        res = con.execute("SELECT * FROM proxy_stats")
+        return [dict(row) for row in res.fetchall()]
+
+    def save_proxy_stats(self, stats: list[dict]) -> None:
+        """Upsert proxy pool state (proxy, latency, success_rate, failures, trips, open_until)."""
+        if not stats:
+            return
+        con = self._get_connection()
+        now = time.time()
+        with con:
+            con.executemany("""
+                    INSERT INTO proxy_stats (proxy, latency, success_rate, failures, trips, open_until, updated_at)
+                    VALUES (:proxy, :latency, :success_rate, :failures, :trips, :open_until, :updated_at)
+                    ON CONFLICT(proxy) DO UPDATE SET
+                        latency = excluded.latency,
+                        success_rate = excluded.success_rate,
+                        failures = excluded.failures,
+                        trips = excluded.trips,
+                        open_until = excluded.open_until,
+                        updated_at = excluded.updated_at
+                    """, [dict(row, updated_at=now) for row in stats])
+
+    def get_job(self, episode_id: int) -> dict | None:
+        con = self._get_connection()
+        row = con.execute("SELECT * FROM episode_jobs WHERE episode_id = ?", (episode_id,)).fetchone()
+        return dict(row) if row else None
+
+    def save_job_stage(self, episode_id: int, stage: str, audio_path: str = None,
+                       transcript_key: str = None, summary: str = None) -> None:
+        """Record the last completed stage; artifacts that are not passed keep their stored value."""
+        con = self._get_connection()
+        with con:
+            con.execute("""
+                    INSERT INTO episode_jobs (episode_id, stage, audio_path, transcript_key, summary, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(episode_id) DO UPDATE SET
+                        stage = excluded.stage,
+                        audio_path = COALESCE(excluded.audio_path, audio_path),
+                        transcript_key = COALESCE(excluded.transcript_key, transcript_key),
+                        summary = COALESCE(excluded.summary, summary),
+                        last_error = NULL,
+                        next_retry_at = 0,
+                        updated_at = excluded.updated_at
+                    """, (episode_id, stage, audio_path, transcript_key, summary, time.time()))
+
+    def record_job_failure(self, episode_id: int, error: str, retry_base: float, retry_max: float) -> dict:
+        """Count a failed attempt and schedule the next one with exponential backoff."""
+        con = self._get_connection()
+        now = time.time()
+        with con:
+            attempts = con.execute("""
+                    INSERT INTO episode_jobs (episode_id, attempts, last_error, updated_at)
+                    VALUES (?, 1, ?, ?)
+                    ON CONFLICT(episode_id) DO UPDATE SET
+                        attempts = attempts + 1,
+                        last_error = excluded.last_error,
+                        updated_at = excluded.updated_at
+                    RETURNING attempts
+                    """, (episode_id, error, now)).fetchone()[0]
+            next_retry_at = now + min(retry_base * 2 ** (attempts - 1), retry_max)
+            con.execute("UPDATE episode_jobs SET next_retry_at = ? WHERE episode_id = ?", (next_retry_at, episode_id))
+        return {'attempts': attempts, 'next_retry_at': next_retry_at}
+
+    def mark_as_used(self, id: int) -> None:
+        con = self._get_connection()
+        with con:
+            con.execute("""
                     UPDATE episodes SET published = 1 WHERE id = ?
                     """, (id, ))
-        con.commit()
-        con.close()
 
     def get_random(self, count: int = 1) -> list[dict]:
-        """Получить случайные неопубликованные эпизоды из базы данных."""
+        """Получить случайные неопубликованные эпизоды из базы данных.
+
+        Вместо ORDER BY RANDOM() (скан и сортировка всей таблицы) берём случайный id
+        в диапазоне неопубликованных и ищем ближайший эпизод по частичному индексу.
+        Эпизоды с next_retry_at в будущем не выбираются.
+        """
         con = self._get_connection()
         cur = con.cursor()
-        res = cur.execute("SELECT * FROM episodes WHERE published = 0 ORDER BY RANDOM() LIMIT ?", (count,))
-        result = [dict(row) for row in res.fetchall()]  # ← Конвертируем в dict
-        con.close()
-        return result
+        low = cur.execute("SELECT MIN(id) FROM episodes INDEXED BY idx_episodes_unpublished WHERE published = 0").fetchone()[0]
+        high = cur.execute("SELECT MAX(id) FROM episodes INDEXED BY idx_episodes_unpublished WHERE published = 0").fetchone()[0]
+        if low is None:
+            return []
+
+        # Эпизоды, которые ждут повторной попытки после ошибки, пропускаем
+        now = time.time()
+        result = {}
+        for _ in range(count * 4):
+            if len(result) >= count:
+                break
+            row = cur.execute(f"""
+                    SELECT * FROM episodes INDEXED BY idx_episodes_unpublished
+                    WHERE published = 0 AND id >= ? AND {NOT_BACKING_OFF} ORDER BY id LIMIT 1
+                    """, (random.randint(low, high), now)).fetchone()
+            if row:
+                result[row['id']] = dict(row)  # ← Конвертируем в dict
+
+        if len(result) < count:
+            # Эпизодов мало — добираем оставшиеся по порядку
+            placeholders = ", ".join("?" * len(result))
+            res = cur.execute(f"""
+                    SELECT * FROM episodes INDEXED BY idx_episodes_unpublished
+                    WHERE published = 0 AND id NOT IN ({placeholders}) AND {NOT_BACKING_OFF} ORDER BY id LIMIT ?
+                    """, (*result.keys(), now, count - len(result)))
+            result.update((row['id'], dict(row)) for row in res.fetchall())
+
+        return list(result.values())
 
 DB = Database(DB_NAME)
 DB.init_db()
\ No newline at end of file
@@ -1,13 +1,21 @@
 from core.parser import fetch_new_episodes
-from core.audio_processor import download_episode
-from core.ai_processor import summarize_groq, summarize_huggingface, transcribe_audio
+from core.audio_cache import audio_cache
+from core.audio_processor import download_episode, partial_download_size
+from core.ai_processor import summarize, transcribe_audio_result, transcription_settings
+from core.llm_client import llm_client
+from core.model_registry import model_registry
+from core.pipeline import Pipeline, Stage
+from core.stream_transcriber import stream_transcribe
+from core.transcript_cache import transcript_cache
 from utils.image_creator import create_episode_image
-from data.database import DB
+from data.database import DB, JOB_STAGES
 from utils.logger import init_logging, get_logger, log_execution_time
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 from core.config import Config
 from utils.proxy_manager import proxy_manager
+from utils.http_client import http_client
+import os
 import time
 import signal
 import sys
@@ -23,16 +31,14 @@ logger = get_logger(__name__)
 
 @log_execution_time(logger, "summary creation")
 def create_summary(transcript: str, episode_title: str) -> str:
-    summary = summarize_groq(transcript, episode_title)
-    if not summary:
-        summary = summarize_huggingface(transcript, episode_title)
-
-    return summary
+    # Запасной провайдер подключается сам, если основной медлит или ошибается
+    return summarize(transcript, episode_title)
 
 
 def download_with_retry(audio_url: str, episode_title: str, max_retries: int = 3) -> Optional[str]:
     """Download episode with retry logic and exponential backoff"""
     for attempt in range(max_retries):
+        downloaded_before = partial_download_size(audio_url)
         try:
             logger.debug(f"Download attempt {attempt + 1}/{max_retries} for: {episode_title}")
             audio_file = download_episode(audio_url=audio_url, episode_title=episode_title)
@@ -42,7 +48,9 @@ def download_with_retry(audio_url: str, episode_title: str, max_retries: int = 3
         except Exception as e:
             logger.warning(f"✗ Download attempt {attempt + 1} failed: {type(e).__name__}: {e}")
             if attempt < max_retries - 1:
-                wait_time = (attempt + 1) * 10  # 10s, 20s, 30s
+                # Если попытка продвинула .part файл — сразу докачиваем, иначе ждём
+                progressed = partial_download_size(audio_url) > downloaded_before
+                wait_time = 0 if progressed else (attempt + 1) * 10  # 10s, 20s, 30s
                 logger.info(f"⏳ Retrying in {wait_time} seconds...")
                 time.sleep(wait_time)
             else:
@@ -52,7 +60,15 @@ def download_with_retry(audio_url: str, episode_title: str, max_retries: int = 3
 
 def mark_episode_as_failed(episode_id: int, reason: str):
     """Mark episode as failed but not published, so it can be retried later"""
-    logger.warning(f"Episode {episode_id} marked for retry. Reason: {reason}")
+    retry = DB.record_job_failure(episode_id, reason, Config.JOB_RETRY_BASE, Config.JOB_RETRY_MAX)
+    retry_at = datetime.fromtimestamp(retry['next_retry_at']).strftime('%Y-%m-%d %H:%M:%S')
+    logger.warning(f"Episode {episode_id} marked for retry at {retry_at} "
+                   f"(attempt {retry['attempts']}). Reason: {reason}")
+
+
+def reached(job: dict, stage: str) -> bool:
+    """Whether the episode has already completed the given stage in an earlier run"""
+    return job['stage'] in JOB_STAGES and JOB_STAGES.index(job['stage']) >= JOB_STAGES.index(stage)
 
 
 @log_execution_time(logger, "episode fetching")
@@ -74,96 +90,200 @@ def fetch_episodes_job():
         logger.error("=" * 60)
 
 
+def prepare_job(episode: dict) -> Optional[dict]:
+    """Validate an episode row and turn it into a pipeline job"""
+    # Безопасное извлечение с fallback значениями
+    episode_id = episode.get('id')
+    podcast_name = episode.get('podcast_name', 'Unknown Podcast')
+    podcast_title = episode.get('podcast_title', 'Untitled')
+    category = episode.get('category', 'General')
+    audio_url = episode.get('audio_url')
+    duration = episode.get('duration', 'Unknown')
+    
+    # Обязательные поля
+    if not episode_id:
+        logger.error("✗ Episode missing required field: id")
+        return None
+    
+    # Проверка валидности URL
+    if not audio_url:
+        problem = f"Episode {episode_id} missing audio_url"
+    elif not isinstance(audio_url, str):
+        problem = f"Invalid audio_url type: {type(audio_url)}"
+    elif not audio_url.startswith(('http://', 'https://')):
+        problem = f"audio_url doesn't start with http(s): {audio_url}"
+    else:
+        problem = None
+
+    if problem:
+        logger.error(f"✗ {problem}")
+        # Иначе get_random будет выдавать этот эпизод каждый запуск
+        mark_episode_as_failed(episode_id, "invalid_episode")
+        return None
+    
+    logger.info(f"📝 Queued episode: '{podcast_title}'")
+    logger.info(f"   Podcast: {podcast_name}")
+    logger.info(f"   Category: {category}")
+    logger.info(f"   Duration: {duration}")
+    logger.info(f"   Episode ID: {episode_id}")
+    
+    job = {
+        "episode": episode,
+        "id": episode_id,
+        "title": podcast_title,
+        "audio_url": audio_url,
+        "stage": None,
+        "error": None,
+        "audio_file": None,
+        "transcript_key": None,
+        "transcript": None,
+        "summary": None,
+    }
+    
+    # Продолжаем с последней завершённой стадии прошлого запуска
+    state = DB.get_job(episode_id)
+    if state and state['stage']:
+        job['stage'] = state['stage']
+        if reached(job, 'summarized'):
+            job['summary'] = state['summary']
+        if reached(job, 'transcribed'):
+            transcription = transcript_cache.get(state['transcript_key']) if state['transcript_key'] else None
+            if transcription and transcription.get('text'):
+                job['transcript_key'] = state['transcript_key']
+                job['transcript'] = transcription['text']
+        if state['audio_path'] and os.path.exists(state['audio_path']):
+            job['audio_file'] = state['audio_path']
+        logger.info(f"   Resuming after stage: {job['stage']} (attempts so far: {state['attempts']})")
+    
+    return job
+
+
+def download_stage(job: dict) -> bool:
+    if Config.STREAM_TRANSCRIBE or job['transcript'] or job['summary']:
+        # Скачивание идёт вместе с транскрибацией, либо аудио уже не нужно
+        return True
+    if job['audio_file']:
+        logger.info(f"⬇ Audio already downloaded: {job['audio_file']}")
+        return True
+    
+    logger.info(f"⬇ Downloading from: {job['audio_url'][:80]}...")
+    
+    # Скачивание с retry
+    job['audio_file'] = download_with_retry(job['audio_url'], job['title'], max_retries=3)
+    
+    if not job['audio_file']:
+        logger.error(f"✗ Failed to download episode after retries: {job['title']}")
+        job['error'] = "download_timeout"
+        return False
+    DB.save_job_stage(job['id'], 'downloaded', audio_path=job['audio_file'])
+    return True
+
+
+def transcribe_stage(job: dict) -> bool:
+    if job['transcript'] or job['summary']:
+        return True
+    
+    cache_key = None
+    if Config.STREAM_TRANSCRIBE:
+        # Скачивание и транскрибация одновременно, без файла на диске
+        logger.info(f"🎙 Streaming and transcribing: {job['audio_url'][:80]}...")
+        try:
+            transcription, cache_key = stream_transcribe(job['audio_url'])
+        except Exception as e:
+            logger.error(f"✗ Streaming transcription failed: {type(e).__name__}: {e}")
+            transcription = None
+    else:
+        audio_file = job['audio_file']
+        # Сначала ищем готовый транскрипт для этого аудио
+        cache_key = transcript_cache.key_for(audio_file, transcription_settings())
+        transcription = transcript_cache.get(cache_key)
+        if transcription:
+            logger.info(f"🎙 Using cached transcript for: {audio_file}")
+        else:
+            logger.info(f"🎙 Transcribing audio file: {audio_file}")
+            transcription = transcribe_audio_result(audio_path=audio_file)
+            if transcription and transcription.get('text'):
+                transcript_cache.put(cache_key, transcription)
+    job['transcript'] = transcription.get('text') if transcription else None
+    
+    if not job['transcript']:
+        logger.error(f"✗ Failed to transcribe episode: {job['title']}")
+        job['error'] = "transcription_failed"
+        return False
+    job['transcript_key'] = cache_key
+    DB.save_job_stage(job['id'], 'transcribed', transcript_key=cache_key)
+    return True
+
+
+def summarize_stage(job: dict) -> bool:
+    if job['summary']:
+        logger.info(f"✍ Using summary from previous run for: {job['title']}")
+    else:
+        logger.info(f"✍ Creating summary for: {job['title']}")
+        job['summary'] = create_summary(transcript=job['transcript'], episode_title=job['title'])
+        
+        if not job['summary']:
+            logger.error(f"✗ Failed to create summary for: {job['title']}")
+            job['error'] = "summarization_failed"
+            return False
+        DB.save_job_stage(job['id'], 'summarized', summary=job['summary'])
+    
+    # Отмечаем эпизод как опубликованный
+    DB.mark_as_used(job['id'])
+    DB.save_job_stage(job['id'], 'published')
+    
+    logger.info("=" * 60)
+    logger.info(f"✓ SUCCESS: Episode processed and published")
+    logger.info(f"  Title: {job['title']}")
+    logger.info(f"  Summary length: {len(job['summary'])} chars")
+    logger.info(f"  Transcript length: {len(job['transcript'] or '')} chars")
+    logger.info("=" * 60)
+    return True
+
+
+def finish_job(job: dict, ok: bool):
+    if not ok:
+        mark_episode_as_failed(job['id'], job['error'] or "unexpected_error")
+    # Аудио больше не нужно пайплайну — кэш может его вытеснить
+    audio_cache.release(job['audio_url'])
+
+
 @log_execution_time(logger, "main pipeline")
 def main_pipeline():
     logger.info("=" * 60)
     logger.info(f"Starting main pipeline at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     logger.info("=" * 60)
+    if Config.USE_PROXY:
+        logger.info(f"Proxy pool: {proxy_manager.metrics()}")
     
     try:
-        episodes = DB.get_random()
+        episodes = DB.get_random(count=Config.PIPELINE_EPISODES)
         if not episodes:
             logger.warning("⚠ No unpublished episodes available")
             return
         
-        episode = episodes[0]
-        
-        # Безопасное извлечение с fallback значениями
-        episode_id = episode.get('id')
-        podcast_id = episode.get('podcast_id', 'unknown')
-        podcast_name = episode.get('podcast_name', 'Unknown Podcast')
-        podcast_title = episode.get('podcast_title', 'Untitled')
-        category = episode.get('category', 'General')
-        audio_url = episode.get('audio_url')
-        duration = episode.get('duration', 'Unknown')
-        
-        # Обязательные поля
-        if not episode_id:
-            logger.error("✗ Episode missing required field: id")
-            return
-        
-        if not audio_url:
-            logger.error(f"✗ Episode {episode_id} missing audio_url")
-            return
-        
-        logger.info(f"📝 Processing episode: '{podcast_title}'")
-        logger.info(f"   Podcast: {podcast_name}")
-        logger.info(f"   Category: {category}")
-        logger.info(f"   Duration: {duration}")
-        logger.info(f"   Episode ID: {episode_id}")
-        
-        # Проверка валидности URL
-        if not isinstance(audio_url, str):
-            logger.error(f"✗ Invalid audio_url type: {type(audio_url)}")
-            return
-        
-        if not audio_url.startswith(('http://', 'https://')):
-            logger.error(f"✗ audio_url doesn't start with http(s): {audio_url}")
-            return
-        
-        logger.info(f"⬇ Downloading from: {audio_url[:80]}...")
-        
-        # Скачивание с retry
-        audio_file = download_with_retry(audio_url, podcast_title, max_retries=3)
-        
-        if not audio_file:
-            error_msg = f"Failed to download episode after retries: {podcast_title}"
-            logger.error(f"✗ {error_msg}")
-            mark_episode_as_failed(episode_id, "download_timeout")
-            return
-        
-        logger.info(f"🎙 Transcribing audio file: {audio_file}")
-        transcript = transcribe_audio(audio_path=audio_file)
-        
-        if not transcript:
-            logger.error(f"✗ Failed to transcribe episode: {podcast_title}")
-            mark_episode_as_failed(episode_id, "transcription_failed")
-            return
-        
-        logger.info(f"✍ Creating summary for: {podcast_title}")
-        summary = create_summary(transcript=transcript, episode_title=podcast_title)
+        jobs = [job for job in map(prepare_job, episodes) if job]
+        # Аудио нужно до конца обработки — не даём кэшу его вытеснить
+        for job in jobs:
+            audio_cache.acquire(job['audio_url'])
         
-        if not summary:
-            logger.error(f"✗ Failed to create summary for: {podcast_title}")
-            mark_episode_as_failed(episode_id, "summarization_failed")
-            return
+        pipeline = Pipeline([
+            Stage("download", download_stage, workers=Config.PIPELINE_DOWNLOAD_WORKERS),
+            Stage("transcribe", transcribe_stage, workers=Config.PIPELINE_TRANSCRIBE_WORKERS),
+            Stage("summarize", summarize_stage, workers=Config.PIPELINE_SUMMARIZE_WORKERS),
+        ], queue_size=Config.PIPELINE_QUEUE_SIZE, on_finish=finish_job)
+        results = pipeline.run(jobs)
         
-        # Отмечаем эпизод как опубликованный
-        DB.mark_as_used(episode_id)
-        
-        logger.info("=" * 60)
-        logger.info(f"✓ SUCCESS: Episode processed and published")
-        logger.info(f"  Title: {podcast_title}")
-        logger.info(f"  Summary length: {len(summary)} chars")
-        logger.info(f"  Transcript length: {len(transcript)} chars")
-        logger.info("=" * 60)
-        
-        return {
-            "episode": episode,
-            "summary": summary,
-            "transcript": transcript,
-            "audio_file": audio_file
-        }
+        logger.info(f"✓ Pipeline run finished: {len(results)} of {len(jobs)} episodes published")
+        return [
+            {
+                "episode": job['episode'],
+                "summary": job['summary'],
+                "transcript": job['transcript'],
+                "audio_file": job['audio_file']
+            }
+            for job in results
+        ]
         
     except Exception as e:
         logger.error("=" * 60)
@@ -177,6 +297,10 @@ def graceful_shutdown(signum, frame):
     logger.info("Received shutdown signal, stopping scheduler...")
     if scheduler and scheduler.running:
         scheduler.shutdown(wait=True)
+    proxy_manager.stop()
+    llm_client.close()
+    DB.close_all()
+    http_client.close()
     logger.info("Scheduler stopped gracefully")
     logger.info("=" * 60)
     sys.exit(0)
@@ -195,6 +319,14 @@ if __name__ == "__main__":
             logger.info("=" * 60)
             proxy_manager.find_working_proxies(max_test=Config.MAX_PROXIES_TO_TEST)
             logger.info("")
+        if Config.USE_PROXY:
+            # Пул прокси пополняется и перепроверяется в фоне
+            proxy_manager.start()
+
+        # Прогрев модели Whisper, чтобы первая задача не ждала загрузки
+        if Config.WHISPER_PRELOAD:
+            logger.info(f"Preloading Whisper model {Config.WHISPER_MODEL}...")
+            model_registry.preload()
 
         scheduler = BackgroundScheduler()
         
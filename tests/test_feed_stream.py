@@ -0,0 +1,72 @@
+"""
+FeedStream must produce the same entry fields as feedparser, since the
+title is the dedup key and older rows were saved from feedparser output.
+"""
+import feedparser
+
+from core.feed_stream import FeedStream
+
+FEED = b"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0"
+     xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd"
+     xmlns:media="http://search.yahoo.com/mrss/"
+     xmlns:dc="http://purl.org/dc/elements/1.1/"
+     xmlns:content="http://purl.org/rss/1.0/modules/content/"
+     xmlns:googleplay="http://www.google.com/schemas/play-podcasts/1.0">
+<channel><title>Show</title>
+<item>
+  <media:title>Media T</media:title>
+  <dc:title>DC T</dc:title>
+  <title>Real Title</title>
+  <media:description>Media description</media:description>
+  <googleplay:description>Google Play description</googleplay:description>
+  <description>Real description</description>
+  <dc:date>2026-01-02T00:00:00Z</dc:date>
+  <pubDate>Fri, 23 Jan 2026 14:34:00 -0000</pubDate>
+  <enclosure url="http://example.com/1.mp3" type="audio/mpeg" length="1"/>
+  <itunes:duration>00:42:00</itunes:duration>
+</item>
+<item>
+  <dc:title>Only DC</dc:title>
+  <title>Second</title>
+  <itunes:summary>Itunes summary</itunes:summary>
+  <enclosure url="http://example.com/2.mp3" type="audio/mpeg" length="1"/>
+</item>
+<item>
+  <media:title>Media only</media:title>
+  <googleplay:description>Google Play description</googleplay:description>
+  <itunes:summary>Itunes summary</itunes:summary>
+  <description>Real description</description>
+  <enclosure url="http://example.com/3.mp3" type="audio/mpeg" length="1"/>
+</item>
+<item>
+  <title>Fourth</title>
+  <content:encoded>Encoded content</content:encoded>
+  <enclosure url="http://example.com/4.mp3" type="audio/mpeg" length="1"/>
+</item>
+</channel></rss>"""
+
+
+class FakeResponse:
+    def __init__(self, body: bytes):
+        self.body = body
+
+    def iter_content(self, chunk_size: int):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+def test_matches_feedparser_with_media_and_dc_children():
+    streamed = list(FeedStream(FakeResponse(FEED), limit=10, chunk_size=64))
+    parsed = feedparser.parse(FEED).entries
+
+    assert len(streamed) == len(parsed) == 4
+    for ours, reference in zip(streamed, parsed):
+        assert ours.get('title') == reference.get('title')
+        assert ours.get('summary') == reference.get('summary')
+        assert ours.get('published') == reference.get('published')
+        assert ours.get('itunes_duration') == reference.get('itunes_duration')
+        assert [e['href'] for e in ours['enclosures']] == [e['href'] for e in reference['enclosures']]
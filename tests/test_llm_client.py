@@ -0,0 +1,142 @@
+"""
+LLMClient against a local mock OpenAI-compatible server.
+
+Every provider gets its own route on the mock server; a test controls how
+slow each route answers and which status it returns.
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+from aiohttp import web
+
+from core.llm_client import LLMClient, Provider
+
+
+class MockServer:
+    def __init__(self):
+        self.behaviour = {}  # provider -> {'delay': секунды, 'status': код ответа}
+        self.calls = []
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._runner = None
+        self.port = asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+
+    async def _start(self) -> int:
+        app = web.Application()
+        app.router.add_post('/{name}/chat/completions', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        return site._server.sockets[0].getsockname()[1]
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        name = request.match_info['name']
+        body = await request.json()
+        self.calls.append(name)
+        behaviour = self.behaviour.get(name, {})
+        await asyncio.sleep(behaviour.get('delay', 0))
+        if behaviour.get('status', 200) != 200:
+            return web.json_response({'error': 'mock failure'}, status=behaviour['status'])
+        return web.json_response({
+            'model': body['model'],
+            'choices': [{'message': {'role': 'assistant', 'content': f'{name}: ok'}}],
+        })
+
+    def url(self, name: str) -> str:
+        return f'http://127.0.0.1:{self.port}/{name}/chat/completions'
+
+    def close(self) -> None:
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+@pytest.fixture
+def server():
+    server = MockServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def make_client(server):
+    clients = []
+
+    def make(hedge_delay: float = 5.0, timeout: float = 5.0) -> LLMClient:
+        client = LLMClient([
+            Provider(name, server.url(name), 'token', 'mock-model', 'system', timeout=timeout)
+            for name in ('primary', 'backup')
+        ], hedge_delay=hedge_delay)
+        clients.append(client)
+        return client
+
+    yield make
+    for client in clients:
+        client.close()
+
+
+def test_hedges_after_delay(server, make_client):
+    client = make_client(hedge_delay=0.2)
+    server.behaviour['primary'] = {'delay': 2}
+
+    started = time.monotonic()
+    assert client.complete('prompt') == 'backup: ok'
+    elapsed = time.monotonic() - started
+
+    assert server.calls == ['primary', 'backup']
+    assert 0.2 <= elapsed < 1.5
+
+
+def test_lost_hedge_keeps_failures(server, make_client):
+    client = make_client(hedge_delay=0.2)
+    primary = client.providers['primary']
+    primary.failures = 1
+    server.behaviour['primary'] = {'delay': 2}
+
+    assert client.complete('prompt') == 'backup: ok'
+
+    # Отменённый запрос — не успех, но его время учитывается в задержке
+    assert primary.failures == 1
+    assert primary.latency >= 0.2
+
+
+def test_falls_back_immediately_on_error(server, make_client):
+    client = make_client(hedge_delay=5)
+    server.behaviour['primary'] = {'status': 500}
+
+    started = time.monotonic()
+    assert client.complete('prompt') == 'backup: ok'
+
+    assert time.monotonic() - started < 1
+    assert client.providers['primary'].failures == 1
+
+
+def test_reranks_primary_by_latency(server, make_client):
+    client = make_client(hedge_delay=5)
+    server.behaviour['primary'] = {'delay': 0.3}
+
+    # Основной медленнее запасного — после пары ответов запасной становится первым
+    client.complete('prompt', providers=['primary'])
+    client.complete('prompt', providers=['backup'])
+    assert [provider.name for provider in client.ranked()] == ['backup', 'primary']
+
+    server.calls.clear()
+    assert client.complete('prompt') == 'backup: ok'
+    assert server.calls == ['backup']
+
+
+def test_timeout_counts_as_failure(server, make_client):
+    client = make_client(hedge_delay=5, timeout=0.3)
+    server.behaviour['primary'] = {'delay': 2}
+    server.behaviour['backup'] = {'delay': 2}
+
+    started = time.monotonic()
+    assert client.complete('prompt') is None
+
+    # Оба запроса упали по таймауту, не дожидаясь ответа сервера
+    assert time.monotonic() - started < 1.5
+    assert client.providers['primary'].failures == 1
+    assert client.providers['backup'].failures == 1
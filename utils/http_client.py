@@ -0,0 +1,103 @@
+"""
+Shared HTTP client for the whole application.
+
+One requests.Session per policy (feed, download, probe) is created
+lazily and reused by every caller, so repeated requests to the same RSS
+host, CDN or proxy keep their TCP/TLS connections alive. urllib3
+pools connections per host and, for proxied requests, per proxy.
+
+Policies bundle the retry strategy, default timeout and headers that used
+to be duplicated at every call site.
+
+Usage:
+    response = http_client.get(url, policy='feed')
+    response = http_client.get(url, policy='download', proxies=proxies, stream=True)
+"""
+
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from core.config import Config
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+BROWSER_USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+POLICIES = {
+    'feed': {
+        'retry': dict(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"]),
+        'timeout': 15,
+        'headers': {
+            'User-Agent': BROWSER_USER_AGENT,
+            'Accept': 'application/rss+xml, application/xml, text/xml, application/atom+xml, */*',
+            'Accept-Language': 'en-US,en;q=0.9',
+            'Accept-Encoding': 'gzip, deflate, br',
+            'Cache-Control': 'no-cache',
+        },
+    },
+    'download': {
+        'retry': dict(total=2, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504]),
+        'timeout': (30, 90),  # (connect timeout, read timeout)
+        'headers': {'User-Agent': BROWSER_USER_AGENT},
+    },
+    'probe': {
+        'retry': dict(total=0),
+        'timeout': 10,
+        'headers': {'User-Agent': 'Mozilla/5.0'},
+    },
+}
+
+
+class HttpClient:
+    def __init__(self, pool_size: int = 16):
+        self.pool_size = pool_size
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, policy: str = 'download') -> requests.Session:
+        """Shared session for a policy (created on first use)"""
+        session = self._sessions.get(policy)
+        if session is not None:
+            return session
+
+        with self._lock:
+            session = self._sessions.get(policy)
+            if session is None:
+                settings = POLICIES[policy]
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    max_retries=Retry(**settings['retry']),
+                    pool_connections=self.pool_size,
+                    pool_maxsize=self.pool_size,
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update(settings['headers'])
+                self._sessions[policy] = session
+                logger.debug(f"Created shared HTTP session for policy '{policy}'")
+        return session
+
+    def request(self, method: str, url: str, policy: str = 'download', proxy: Optional[str] = None,
+                **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', POLICIES[policy]['timeout'])
+        if proxy:
+            kwargs['proxies'] = {'http': proxy, 'https': proxy}
+        return self.session(policy).request(method, url, **kwargs)
+
+    def get(self, url: str, policy: str = 'download', **kwargs) -> requests.Response:
+        return self.request('GET', url, policy=policy, **kwargs)
+
+    def close(self) -> None:
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.close()
+
+
+# Глобальный HTTP-клиент
+http_client = HttpClient(pool_size=Config.HTTP_POOL_SIZE)
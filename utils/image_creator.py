@@ -1,18 +1,29 @@
+from functools import lru_cache
+
+import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 import textwrap
 
-def create_gradient(width, height, start_color, end_color):
-    """Создает градиентный фон."""
+@lru_cache(maxsize=8)
+def _gradient_template(width, height, start_color, end_color):
+    """Градиент считается один раз на размер и цвета, дальше берётся из кэша."""
     base = Image.new('RGB', (width, height), start_color)
     top = Image.new('RGB', (width, height), end_color)
-    mask = Image.new('L', (width, height))
-    mask_data = []
-    for y in range(height):
-        mask_data.extend([int(255 * (y / height))] * width)
-    mask.putdata(mask_data)
+    # Маска: строка y целиком заполнена значением 255 * y / height
+    ramp = (255 * np.arange(height) / height).astype(np.uint8)
+    mask = Image.fromarray(np.repeat(ramp[:, None], width, axis=1), 'L')
     base.paste(top, (0, 0), mask)
     return base
 
+def create_gradient(width, height, start_color, end_color):
+    """Создает градиентный фон."""
+    # Копия, чтобы рисование на картинке не портило шаблон в кэше
+    return _gradient_template(width, height, start_color, end_color).copy()
+
+@lru_cache(maxsize=16)
+def _font(path, size):
+    return ImageFont.truetype(path, size)
+
 def create_episode_image(episode_title: str, podcast_name: str) -> str:
     width, height = 1200, 630
     # Градиент от #1a1a2e к #2a2a4e для глубины
@@ -20,9 +31,9 @@ def create_episode_image(episode_title: str, podcast_name: str) -> str:
     draw = ImageDraw.Draw(img)
 
     # Шрифты (предполагаем, что они есть)
-    font_title = ImageFont.truetype("./fonts/Inter-Bold.ttf", 72)
-    font_podcast = ImageFont.truetype("./fonts/Inter-Regular.ttf", 48)
-    font_small = ImageFont.truetype("./fonts/Inter-Regular.ttf", 24)  # Для "Эпизод"
+    font_title = _font("./fonts/Inter-Bold.ttf", 72)
+    font_podcast = _font("./fonts/Inter-Regular.ttf", 48)
+    font_small = _font("./fonts/Inter-Regular.ttf", 24)  # Для "Эпизод"
 
     # Обертывание заголовка: макс. 30 символов на строку
     wrapped_title = textwrap.wrap(episode_title, width=30)
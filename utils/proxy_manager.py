@@ -1,99 +1,327 @@
+import os
 import random
-import requests
-from typing import Optional, List
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, List, Dict
+from core.config import Config
+from data.database import DB
+from utils.http_client import http_client
 from utils.logger import get_logger
 import time
 
 logger = get_logger(__name__)
 
+# Поля состояния прокси, которые сохраняются в БД
+PERSISTED_FIELDS = ('latency', 'success_rate', 'failures', 'trips', 'open_until')
+# Размер таблицы взвешенного выбора (прокси повторяется пропорционально весу)
+SNAPSHOT_SLOTS = 256
+
+
 class ProxyManager:
+    """
+    Scored proxy pool.
+
+    Every proxy keeps an EWMA of its latency and success rate. Selection is
+    weighted by success_rate / latency. Failures open a circuit breaker with
+    an exponentially growing cooldown; once it expires the proxy is half-open
+    and gets a single trial (a background probe or one real request) before
+    it is trusted again. State is persisted in the proxy_stats table.
+
+    A background refresher keeps PROXY_MIN_WORKING validated proxies ready and
+    reloads the proxy file when it changes. get_proxy only reads a prebuilt
+    selection table, so it never waits for tests.
+    """
+
     def __init__(self, proxy_file: str = "./data/proxies.txt"):
         self.proxy_file = proxy_file
         self.proxies: List[str] = []
-        self.working_proxies: List[str] = []
-        self.failed_proxies: set = set()
         self.current_proxy: Optional[str] = None
+        self.last_refresh: Optional[float] = None
+        self._proxy_file_mtime: Optional[float] = None
+        # Таблица выбора для get_proxy — пересобирается при каждом изменении состояния
+        self._slots: tuple = ()
+        # Состояние по прокси: latency/success_rate (EWMA), failures, trips, open_until, throughput...
+        self.stats: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
         self.load_proxies()
-    
+        self.load_state()
+
     def load_proxies(self):
         """Load proxies from file"""
         try:
+            self._proxy_file_mtime = os.path.getmtime(self.proxy_file)
             with open(self.proxy_file, 'r') as f:
                 self.proxies = [line.strip() for line in f if line.strip()]
             logger.info(f"Loaded {len(self.proxies)} proxies from {self.proxy_file}")
         except FileNotFoundError:
             logger.warning(f"Proxy file {self.proxy_file} not found")
+            self._proxy_file_mtime = None
             self.proxies = []
-    
-    def test_proxy(self, proxy: str, timeout: int = 10) -> bool:
-        """Test if proxy is working"""
+
+    def reload_if_changed(self) -> bool:
+        """Re-read the proxy file if it was modified; forget proxies that were removed"""
         try:
-            proxies = {
-                'http': proxy,
-                'https': proxy
-            }
-            response = requests.get(
-                'http://httpbin.org/ip',
-                proxies=proxies,
-                timeout=timeout,
-                headers={'User-Agent': 'Mozilla/5.0'}
+            mtime = os.path.getmtime(self.proxy_file)
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._proxy_file_mtime:
+            return False
+
+        self.load_proxies()
+        known = set(self.proxies)
+        with self._lock:
+            for proxy in [proxy for proxy in self.stats if proxy not in known]:
+                del self.stats[proxy]
+            self._rebuild_snapshot()
+        return True
+
+    def load_state(self):
+        """Restore scores and breaker state saved by a previous run"""
+        known = set(self.proxies)
+        with self._lock:
+            for row in DB.load_proxy_stats():
+                if row['proxy'] in known:
+                    self.stats[row['proxy']] = {field: row[field] for field in PERSISTED_FIELDS}
+            self._rebuild_snapshot()
+        if self.stats:
+            logger.info(f"Restored state of {len(self.stats)} proxies "
+                        f"({len(self.working_proxies)} working, {len(self.failed_proxies)} cooling down)")
+
+    def _save(self, proxy: str, entry: dict) -> None:
+        DB.save_proxy_stats([dict({field: entry[field] for field in PERSISTED_FIELDS}, proxy=proxy)])
+
+    def _entry(self, proxy: str) -> dict:
+        entry = self.stats.get(proxy)
+        if entry is None:
+            entry = self.stats[proxy] = {'latency': None, 'success_rate': 1.0, 'failures': 0, 'trips': 0, 'open_until': 0}
+        return entry
+
+    @staticmethod
+    def _is_open(entry: dict) -> bool:
+        return entry['open_until'] > 0
+
+    def _rebuild_snapshot(self) -> None:
+        """Rebuild the weighted selection table (call with the lock held)"""
+        candidates, weights = [], []
+        for proxy, entry in self.stats.items():
+            if not self._is_open(entry):
+                candidates.append(proxy)
+                # Быстрые и надёжные прокси выбираются чаще
+                latency = entry['latency'] if entry['latency'] is not None else Config.PROXY_TEST_TIMEOUT / 2
+                weights.append(max(entry['success_rate'], 0.01) / max(latency, 0.05))
+
+        total = sum(weights)
+        slots = []
+        for proxy, weight in zip(candidates, weights):
+            slots.extend([proxy] * max(1, round(SNAPSHOT_SLOTS * weight / total)))
+        self._slots = tuple(slots)
+
+    @property
+    def working_proxies(self) -> List[str]:
+        """Proxies with a closed circuit breaker"""
+        return [proxy for proxy, entry in list(self.stats.items()) if not self._is_open(entry)]
+
+    @property
+    def failed_proxies(self) -> set:
+        """Proxies whose circuit breaker is open (cooling down or half-open)"""
+        return {proxy for proxy, entry in list(self.stats.items()) if self._is_open(entry)}
+
+    def record_success(self, proxy: str, latency: Optional[float] = None) -> None:
+        alpha = Config.PROXY_EWMA_ALPHA
+        with self._lock:
+            entry = self._entry(proxy)
+            if latency is not None:
+                entry['latency'] = latency if entry['latency'] is None else alpha * latency + (1 - alpha) * entry['latency']
+            entry['success_rate'] = alpha + (1 - alpha) * entry['success_rate']
+            recovered = self._is_open(entry)
+            entry.update(failures=0, trips=0, open_until=0, trial=False)
+            snapshot = dict(entry)
+            self._rebuild_snapshot()
+        if recovered:
+            logger.info(f"✓ Proxy recovered: {proxy}")
+        self._save(proxy, snapshot)
+
+    def record_failure(self, proxy: str, trip: bool = False) -> None:
+        """Count a failure; open the breaker after PROXY_FAILURE_THRESHOLD in a row (or at once if trip)"""
+        alpha = Config.PROXY_EWMA_ALPHA
+        with self._lock:
+            entry = self._entry(proxy)
+            entry['success_rate'] = (1 - alpha) * entry['success_rate']
+            entry['failures'] += 1
+            entry['trial'] = False
+            # Неудача в полуоткрытом состоянии сразу открывает breaker снова
+            if trip or self._is_open(entry) or entry['failures'] >= Config.PROXY_FAILURE_THRESHOLD:
+                entry['trips'] += 1
+                cooldown = min(Config.PROXY_COOLDOWN * 2 ** (entry['trips'] - 1), Config.PROXY_MAX_COOLDOWN)
+                entry['open_until'] = time.time() + cooldown
+                logger.warning(f"Proxy {proxy} disabled for {cooldown:.0f}s after {entry['failures']} failures")
+            snapshot = dict(entry)
+            self._rebuild_snapshot()
+            working = len(self._slots)
+        self._save(proxy, snapshot)
+        if not working:
+            self._wakeup.set()
+
+    def test_proxy(self, proxy: str, timeout: Optional[float] = None) -> bool:
+        """Test if proxy is working, records its latency and throughput"""
+        started = time.monotonic()
+        try:
+            response = http_client.get(
+                Config.PROXY_TEST_URL,
+                policy='probe',
+                proxy=proxy,
+                timeout=timeout or Config.PROXY_TEST_TIMEOUT
             )
+            latency = response.elapsed.total_seconds()
+            size = len(response.content)
             if response.status_code == 200:
-                logger.debug(f"✓ Proxy working: {proxy}")
+                elapsed = max(time.monotonic() - started, 1e-6)
+                with self._lock:
+                    self._entry(proxy).update(throughput=size / elapsed, checked_at=time.time())
+                self.record_success(proxy, latency)
+                logger.debug(f"✓ Proxy working: {proxy} ({latency * 1000:.0f} ms)")
                 return True
         except Exception as e:
             logger.debug(f"✗ Proxy failed: {proxy} - {type(e).__name__}")
+        self.record_failure(proxy, trip=True)
         return False
-    
-    def find_working_proxies(self, max_test: int = 10, parallel: bool = False):
-        """Find working proxies from the list"""
-        logger.info(f"Testing up to {max_test} proxies...")
-        
+
+    def _probe(self, candidates: List[str], enough: Optional[int], parallel: bool = True) -> int:
+        """Probe candidates concurrently, stop once `enough` proxies are working; returns number tested"""
+        if not candidates:
+            return 0
+        workers = max(1, min(Config.PROXY_TEST_CONCURRENCY, len(candidates))) if parallel else 1
         tested = 0
-        for proxy in self.proxies:
-            if tested >= max_test:
-                break
-            
-            if proxy in self.failed_proxies:
-                continue
-            
-            if self.test_proxy(proxy):
-                self.working_proxies.append(proxy)
-                logger.info(f"✓ Found working proxy: {proxy}")
-            else:
-                self.failed_proxies.add(proxy)
-            
-            tested += 1
-            time.sleep(0.5)  # Небольшая задержка между тестами
-        
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="proxy-test")
+        try:
+            futures = {executor.submit(self.test_proxy, proxy): proxy for proxy in candidates}
+            for future in as_completed(futures):
+                proxy = futures[future]
+                tested += 1
+                if future.result():
+                    logger.info(f"✓ Found working proxy: {proxy} ({self.stats[proxy]['latency'] * 1000:.0f} ms)")
+                    if enough and len(self.working_proxies) >= enough:
+                        break
+        finally:
+            # Непроверенные прокси отменяем, уже запущенные проверки не ждём
+            executor.shutdown(wait=False, cancel_futures=True)
+        return tested
+
+    def find_working_proxies(self, max_test: int = 10, parallel: bool = True, enough: Optional[int] = None):
+        """
+        Find working proxies from the list.
+
+        Up to PROXY_TEST_CONCURRENCY proxies are probed at once; testing stops
+        as soon as `enough` healthy proxies are known.
+        """
+        enough = enough or Config.PROXY_MIN_WORKING
+        if len(self.working_proxies) >= enough:
+            return True
+        candidates = [proxy for proxy in self.proxies if proxy not in self.stats][:max_test]
+        if not candidates:
+            return len(self.working_proxies) > 0
+        logger.info(f"Testing up to {len(candidates)} proxies...")
+        tested = self._probe(candidates, enough, parallel)
+
         logger.info(f"Found {len(self.working_proxies)} working proxies out of {tested} tested")
         return len(self.working_proxies) > 0
-    
+
+    def revalidate(self) -> int:
+        """Probe proxies whose cooldown has expired (half-open), returns how many recovered"""
+        now = time.time()
+        with self._lock:
+            due = [proxy for proxy, entry in self.stats.items()
+                   if self._is_open(entry) and entry['open_until'] <= now]
+        if not due:
+            return 0
+        before = len(self.working_proxies)
+        self._probe(due, enough=None)
+        recovered = len(self.working_proxies) - before
+        logger.info(f"Revalidated {len(due)} proxies, {recovered} recovered")
+        return recovered
+
+    def refresh(self):
+        """Reload the proxy file, re-probe cooled down proxies and top up the pool"""
+        if self.reload_if_changed():
+            logger.info("Proxy file changed, pool updated")
+        self.revalidate()
+        if len(self.working_proxies) < Config.PROXY_MIN_WORKING:
+            self.find_working_proxies(max_test=Config.MAX_PROXIES_TO_TEST)
+        self.last_refresh = time.time()
+        logger.debug(f"Proxy pool: {self.metrics()}")
+
+    def _refresh_loop(self):
+        while not self._stopped.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Proxy refresh failed: {type(e).__name__}: {e}", exc_info=True)
+            self._wakeup.wait(Config.PROXY_REFRESH_INTERVAL)
+            self._wakeup.clear()
+
+    def start(self):
+        """Start the background refresher"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._refresh_loop, name="proxy-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def metrics(self) -> dict:
+        """Pool size and health"""
+        entries = list(self.stats.items())
+        working = [entry for _, entry in entries if not self._is_open(entry)]
+        latencies = [entry['latency'] for entry in working if entry['latency'] is not None]
+        return {
+            'total': len(self.proxies),
+            'working': len(working),
+            'cooling_down': len(entries) - len(working),
+            'untested': len([proxy for proxy in self.proxies if proxy not in self.stats]),
+            'avg_latency_ms': round(sum(latencies) / len(latencies) * 1000) if latencies else None,
+            'avg_success_rate': round(sum(entry['success_rate'] for entry in working) / len(working), 3) if working else None,
+            'last_refresh': self.last_refresh,
+        }
+
     def get_proxy(self) -> Optional[dict]:
-        """Get a random working proxy"""
-        if not self.working_proxies:
-            logger.warning("No working proxies available, trying to find some...")
-            if not self.find_working_proxies(max_test=20):
-                logger.error("Could not find any working proxies")
-                return None
-        
-        # Выбираем случайный прокси из рабочих
-        self.current_proxy = random.choice(self.working_proxies)
+        """Pick a working proxy weighted by score (O(1), never blocks on testing)"""
+        slots = self._slots
+        if slots:
+            proxy = random.choice(slots)
+        else:
+            # Рабочих нет — даём одну пробную попытку прокси с истёкшим cooldown
+            now = time.time()
+            with self._lock:
+                half_open = [(entry['open_until'], proxy) for proxy, entry in self.stats.items()
+                             if self._is_open(entry) and entry['open_until'] <= now and not entry.get('trial')]
+                proxy = min(half_open)[1] if half_open else None
+                if proxy:
+                    self.stats[proxy]['trial'] = True
+
+        if proxy is None:
+            logger.warning("No working proxies available, background refresh requested")
+            self._wakeup.set()
+            return None
+
+        self.current_proxy = proxy
         logger.debug(f"Using proxy: {self.current_proxy}")
-        
+
         return {
-            'http': self.current_proxy,
-            'https': self.current_proxy
+            'http': proxy,
+            'https': proxy
         }
-    
+
     def mark_proxy_as_failed(self, proxy: str):
-        """Mark proxy as failed and remove from working list"""
-        if proxy in self.working_proxies:
-            self.working_proxies.remove(proxy)
-            self.failed_proxies.add(proxy)
-            logger.warning(f"Marked proxy as failed: {proxy}")
-            logger.info(f"Remaining working proxies: {len(self.working_proxies)}")
-    
+        """Record a failed request through proxy (may open its circuit breaker)"""
+        self.record_failure(proxy)
+        logger.info(f"Remaining working proxies: {len(self.working_proxies)}")
+
     def get_next_proxy(self) -> Optional[dict]:
         """Get next proxy (marks current as failed and gets new one)"""
         if self.current_proxy:
@@ -102,4 +330,4 @@ class ProxyManager:
 
 
 # Глобальный экземпляр менеджера прокси
-proxy_manager = ProxyManager()
\ No newline at end of file
+proxy_manager = ProxyManager()